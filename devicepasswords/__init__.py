@@ -6,20 +6,29 @@ Device password manager.
 """
 import asyncio
 import json
+import os
 import sys
 import time
 
 from asgiref.sync import async_to_sync
-from asgiref.wsgi import WsgiToAsgi
 from flask import Flask
 from flask_alembic import Alembic
-from flask_session import Session
 
+from .adb import adb
+from .calibrate import calibrate_all
+from .commands import commands
 from .db import db
 from .devpwd import device_passwords
+from .hashpool import hash_pool
 from .headers import add_security_headers, add_nonce
+from .metrics import metrics
+from .migrate import upgrade
 from .oidc import oidc
-from .pwdhash import hasher
+from .pwdhash import hasher, configure
+from .retention import sweeper
+from .revocation import revocations
+from .sessions import CachedSession
+from .usage import usage
 from .views import views
 
 
@@ -28,13 +37,29 @@ def create_app():
     app.config.from_mapping({
         "HSTS": False,
         "WORDLIST": "wordlist.txt",
+        "WORDLISTS": {},
+        # Private directory of files shared by the workers.
+        "RUNTIME_DIR": os.path.join(app.instance_path, "run"),
+        "WORDLIST_CACHE_DIR": None,
         "OIDC_CLAIM_EMAIL": "email",
         "OIDC_CLAIM_EMAIL_VERIFIED": "email_verified",
         "OIDC_CLAIM_USERNAME": "preferred_username",
+        "OIDC_USERINFO_CACHE_TTL": 60,
         "OIDC_SCOPE": "openid email profile",
+        "OIDC_HTTP_POOL_SIZE": 100,
+        "OIDC_HTTP_TIMEOUT": 30,
+        "OIDC_HTTP_CONNECT_TIMEOUT": 5,
+        "OIDC_HTTP_READ_TIMEOUT": 10,
+        "OIDC_HTTP_RETRIES": 2,
+        "OIDC_BREAKER_THRESHOLD": 5,
+        "OIDC_BREAKER_RESET": 30,
         "PASSWORD_HASH": "plaintext",
+        "PASSWORD_HASHES": [],
+        "PASSWORD_HASH_SETTINGS": {},
+        "PASSWORD_HASH_CALIBRATE": 0,
         "PASSWORD_MAX_EXPIRATION_DAYS": 0,
         "PASSWORD_ENTROPY": 64,
+        "HASH_WORKERS": 0,
         "UI_HEADING": "Device passwords",
         "UI_HEADING_SUB": "",
         "UI_SHOW_SUBJECT": True,
@@ -43,7 +68,18 @@ def create_app():
         "UI_LOGINS": False,
         "SESSION_TYPE": "sqlalchemy",
         "SESSION_SQLALCHEMY": db,
+        # Only write sessions to the database if they changed.
+        "SESSION_REFRESH_EACH_REQUEST": False,
+        "SESSION_CACHE_TTL": 5,
+        "SESSION_REFRESH_WINDOW": 60,
         "DO_NOT_MIGRATE": False,
+        "DATABASE_ASYNC": True,
+        "REVOKED_CACHE_TTL": 5,
+        "SWEEP_INTERVAL": 3600,
+        "SWEEP_BATCH_SIZE": 500,
+        "USAGE_FLUSH_INTERVAL": 10,
+        "METRICS": False,
+        "METRICS_DIR": None,
     })
     app.config.from_prefixed_env("DP")
 
@@ -53,16 +89,35 @@ def create_app():
             app.logger.error(f"DP_{var} not set.")
             raise ValueError(f"DP_{var} not set.")
 
-    # Validate value of PASSWORD_HASH value
+    # Validate value of PASSWORD_HASH(ES) value and its settings
+    if not isinstance(app.config["PASSWORD_HASHES"], list):
+        app.logger.error("DP_PASSWORD_HASHES must be a JSON list.")
+        raise ValueError("DP_PASSWORD_HASHES must be a JSON list.")
+    if not isinstance(app.config["PASSWORD_HASH_SETTINGS"], dict):
+        app.logger.error("DP_PASSWORD_HASH_SETTINGS must be a JSON object.")
+        raise ValueError("DP_PASSWORD_HASH_SETTINGS must be a JSON object.")
+    # Each scheme is stored once per token.
+    schemes = list(dict.fromkeys([app.config["PASSWORD_HASH"],
+                                  *app.config["PASSWORD_HASHES"]]))
+    if len(schemes) != 1 + len(app.config["PASSWORD_HASHES"]):
+        app.logger.warning("Ignoring duplicate schemes of "
+                           "DP_PASSWORD_HASHES.")
+    app.config["PASSWORD_HASHES"] = schemes[1:]
+    scheme = schemes[0]
     try:
-        hasher.hash("", scheme=app.config["PASSWORD_HASH"])
-    except KeyError:
-        app.logger.error(
-            f"Invalid password hash {app.config['PASSWORD_HASH']}",
-            exc_info=sys.exc_info()
-        )
+        configure(app.config["PASSWORD_HASH_SETTINGS"])
+        for scheme in schemes:
+            hasher.hash("", scheme=scheme)
+    except (KeyError, ValueError):
+        app.logger.error(f"Invalid password hash {scheme}",
+                         exc_info=sys.exc_info())
         raise
 
+    if target := app.config["PASSWORD_HASH_CALIBRATE"]:
+        settings = calibrate_all(schemes, int(target) / 1000)
+        app.logger.info(f"Calibrated password hash settings: {settings}")
+        configure({**app.config["PASSWORD_HASH_SETTINGS"], **settings})
+
     # Validate PASSWORD_MAX_EXPIRATION_DAYS is an integer or can be casted to
     # one.
     try:
@@ -76,35 +131,38 @@ def create_app():
         raise
 
     app.register_blueprint(views)
+    app.cli.add_command(commands)
     db.init_app(app)
-    create_all = db.create_all
-    # Prevent automatic call create_all which kills alembic
-    db.create_all = lambda bind_key=None: None
-    Session(app)
-    db.create_all = create_all
+    adb.init_app(app)
     # Required for Alembic, was removed in some flask-sqlalchemy version.
     app.extensions["sqlalchemy"].db = db
     alembic = Alembic(app)
 
     if not app.config["DO_NOT_MIGRATE"]:
         with app.app_context():
-            alembic.upgrade()
+            upgrade(alembic)
+
+    # After the migration, as Flask-Session creates its missing table.
+    CachedSession(app)
 
     oidc.init_app(app)
 
-    for i in range(5):
-        time.sleep(2 ** i - 1)
-        try:
-            asyncio.run(oidc.refresh_config())
-        except Exception as e:
-            last = e
-            app.logger.warning(f"Cannot connect to IdP (try {i + 1}/5)",
-                               exc_info=sys.exc_info())
+    # Start with the metadata of the shared cache, even if expired, as it
+    # is refreshed in background.
+    if not oidc.load_cache():
+        for i in range(5):
+            time.sleep(2 ** i - 1)
+            try:
+                asyncio.run(oidc.refresh_metadata())
+            except Exception as e:
+                last = e
+                app.logger.warning(f"Cannot connect to IdP (try {i + 1}/5)",
+                                   exc_info=sys.exc_info())
+            else:
+                break
         else:
-            break
-    else:
-        app.logger.error("Cannot connect to IdP try (5/5).")
-        raise last
+            app.logger.error("Cannot connect to IdP try (5/5).")
+            raise last
 
     # Manual overwriting keys here
     # Some IdPs may have different keys for consumer and business accounts,
@@ -112,11 +170,14 @@ def create_app():
     if keyfile := app.config.get("OIDC_CERTS"):
         with open(keyfile) as kf:
             oidc.set_keys(json.load(kf))
-    else:
-        asyncio.run(oidc.refresh_keys())
     oidc.refresh = True  # Automatically reload in background.
 
     device_passwords.init_app(app)
+    hash_pool.init_app(app)
+    revocations.init_app(app)
+    sweeper.init_app(app)
+    usage.init_app(app)
+    metrics.init_app(app)
 
     app.before_request(add_nonce)
     app.after_request(add_security_headers)
@@ -125,4 +186,5 @@ def create_app():
 
 
 def create_asgi():
-    return WsgiToAsgi(create_app())
+    from .asgi import create_app as create_asgi_app
+    return create_asgi_app()
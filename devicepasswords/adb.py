@@ -0,0 +1,130 @@
+# SPDX-License-Identifier: MPL-2.0
+"""
+Async database access.
+
+Database accesses of requests are written as functions of a session, e.g.
+``def count(session, sub)``, and run with ``await adb.run(count, sub)``.
+
+If an async driver for the database is installed (aiosqlite, asyncpg or
+aiomysql) and supports the arguments of the database URL, they run on an
+async session of the background loop. Waiting
+for the database then does not occupy a thread, so the size of the thread
+pool no longer limits concurrent requests. Otherwise, they run on the
+Flask-SQLAlchemy session in a thread.
+"""
+import importlib.util
+import logging
+from typing import Any, Callable, Concatenate, ParamSpec, TypeVar
+
+import sqlalchemy as sa
+from asgiref.sync import sync_to_async
+from flask import Flask
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
+
+from .aio import background
+from .db import db
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+#: Async drivers of the database backends.
+DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+    "mysql": "aiomysql",
+    "mariadb": "aiomysql",
+}
+#: Query arguments of database URLs supported by the async drivers, with
+#: their name and type for the async driver. None if the async dialect
+#: handles the arguments of the sync drivers itself.
+CONNECT_ARGS: dict[str, dict[str, tuple[str, type]] | None] = {
+    "aiosqlite": None,
+    "asyncpg": {
+        "sslmode": ("ssl", str),
+        "connect_timeout": ("timeout", float),
+    },
+    "aiomysql": {
+        "charset": ("charset", str),
+        "connect_timeout": ("connect_timeout", int),
+    },
+}
+
+
+def async_url(url: str) -> tuple[sa.URL, dict[str, Any]] | None:
+    """Return the URL of the database with an async driver and the connect
+    arguments translated from its query, or None if no async driver is
+    installed or it does not support an argument of the query."""
+    url = sa.make_url(url)
+    backend = url.get_backend_name()
+    if not (driver := DRIVERS.get(backend)):
+        return None
+    # SQLAlchemy runs the sync session code in greenlets.
+    if not all(importlib.util.find_spec(module)
+               for module in (driver, "greenlet")):
+        return None
+    url = url.set(drivername=f"{backend}+{driver}")
+
+    if (supported := CONNECT_ARGS[driver]) is None:
+        return url, {}
+    connect_args = {}
+    for name, value in url.query.items():
+        if name not in supported or not isinstance(value, str):
+            logger.info("%s does not support the database URL argument "
+                        "%s." % (driver, name))
+            return None
+        arg, type_ = supported[name]
+        connect_args[arg] = type_(value)
+    return url.set(query={}), connect_args
+
+
+class AsyncDatabase:
+    """Run database accesses on an async engine, if available."""
+
+    engine = None
+    _sessionmaker = None
+
+    async def run(self, fn: Callable[Concatenate[Session, P], T],
+                  *args: P.args, **kwargs: P.kwargs) -> T:
+        """Run fn(session, *args, **kwargs) and return its result.
+
+        fn must commit its changes and must not use the app context, as it
+        may run outside of it.
+        """
+        with metrics.time_database():
+            if self.engine is None:
+                # Not bound to the thread of the request, as requests served
+                # natively on the event loop of the server would share it.
+                return await sync_to_async(fn, thread_sensitive=False)(
+                    db.session, *args, **kwargs
+                )
+
+            async def run():
+                async with self._sessionmaker() as session:
+                    return await session.run_sync(fn, *args, **kwargs)
+            return await background.call(run())
+
+    def init_app(self, app: Flask) -> None:
+        self.engine = None
+        if not app.config["DATABASE_ASYNC"]:
+            return
+        if url := app.config.get("SQLALCHEMY_ASYNC_DATABASE_URI"):
+            connection = url, {}
+        else:
+            connection = async_url(app.config["SQLALCHEMY_DATABASE_URI"])
+        if connection is None:
+            logger.info("No async database driver for the database URL "
+                        "installed, using threads.")
+            return
+
+        url, connect_args = connection
+        self.engine = create_async_engine(url, connect_args=connect_args,
+                                          pool_pre_ping=True)
+        self._sessionmaker = async_sessionmaker(self.engine,
+                                                expire_on_commit=False)
+
+
+adb = AsyncDatabase()
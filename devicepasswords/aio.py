@@ -0,0 +1,57 @@
+# SPDX-License-Identifier: MPL-2.0
+"""
+Background event loop.
+
+Async views run on a new event loop per request, so resources bound to an
+event loop, e.g. pooled HTTP connections, cannot be shared between
+requests. Such resources live on an event loop in a daemon thread of each
+worker instead, and coroutines using them are run there.
+"""
+import asyncio
+import concurrent.futures
+import os
+import threading
+from typing import Coroutine, TypeVar
+
+T = TypeVar("T")
+
+
+class BackgroundLoop:
+    """Event loop running in a daemon thread of the current process."""
+
+    _loop: asyncio.AbstractEventLoop | None = None
+    _pid: int | None = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """Return the loop, start it on first use or after a fork."""
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._pid = os.getpid()
+                threading.Thread(target=self._loop.run_forever,
+                                 name="background-loop", daemon=True).start()
+            return self._loop
+
+    def submit(self, coro: Coroutine[None, None, T]) -> \
+            concurrent.futures.Future[T]:
+        """Schedule a coroutine on the loop from any thread."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def call(self, coro: Coroutine[None, None, T]) -> T:
+        """Run a coroutine on the loop and await its result from any
+        event loop."""
+        if asyncio.get_running_loop() is self._loop:
+            return await coro
+        return await asyncio.wrap_future(self.submit(coro))
+
+    def run(self, coro: Coroutine[None, None, T]) -> T:
+        """Run a coroutine on the loop and wait for its result. Must not be
+        called from the loop itself."""
+        return self.submit(coro).result()
+
+
+background = BackgroundLoop()
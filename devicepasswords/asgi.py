@@ -1,12 +1,188 @@
 """
 ASGI application.
+
+Bridged through :class:`asgiref.wsgi.WsgiToAsgi`, every request is handed
+to a thread running the WSGI app, which runs the async view on a new event
+loop. The API endpoints, which are called often and wait for the database,
+the OIDC provider and the hashing pool, are instead dispatched directly on
+the event loop of the server. Only the blocking parts of a request, loading
+and saving the session, are run in threads.
+
+All other endpoints, e.g. the rendered pages, and the lifespan protocol are
+passed to the bridged WSGI app.
 """
+import asyncio
+import inspect
+import io
 
-from asgiref.wsgi import WsgiToAsgi
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from flask import (Flask, Request, Response, request, request_finished,
+                   request_started)
+from flask.ctx import RequestContext
+from flask.sessions import SessionMixin
+from werkzeug.exceptions import HTTPException
 
 from . import create_app as create_wsgi_app
+from .db import db
+
+#: Endpoints dispatched on the event loop of the server.
+NATIVE_ENDPOINTS = frozenset({
+    "views.ping",
+    "views.tokens",
+    "views.verify",
+    "views.frontchannel_logout",
+    "views.backchannel_logout",
+})
+
+
+class AsgiApp:
+    """ASGI application serving the API endpoints of a Flask app natively
+    and the others via the WSGI bridge."""
+
+    def __init__(self, app: Flask, endpoints=NATIVE_ENDPOINTS):
+        self.app = app
+        self.endpoints = endpoints
+        self.bridge = WsgiToAsgi(app)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.bridge(scope, receive, send)
+
+        body = await self._read_body(receive)
+        if body is None:
+            return  # Client disconnected.
+        # The environ is built like by the bridge, which reads the headers
+        # from the scope of the instance.
+        instance = WsgiToAsgiInstance(self.app)
+        instance.scope = scope
+        environ = instance.build_environ(scope, body)
+        req = self.app.request_class(environ)
+
+        if self._endpoint(req) not in self.endpoints:
+            return await self.bridge(scope, self._replay(body), send)
+
+        response = await self.dispatch(req)
+        await self._send_response(response, environ, send)
+
+    def _endpoint(self, req: Request) -> str | None:
+        try:
+            endpoint, _ = self.app.create_url_adapter(req).match()
+        except HTTPException:
+            return None
+        return endpoint
+
+    async def dispatch(self, req: Request) -> Response:
+        """Handle the request like :meth:`Flask.wsgi_app`, awaiting the view
+        on the running event loop."""
+        app = self.app
+        environ = req.environ
+        with app.app_context():
+            session = await asyncio.to_thread(self._open_session, req)
+
+            ctx = RequestContext(app, environ, req, session)
+            error = None
+            try:
+                ctx.push()
+                try:
+                    response = await self._full_dispatch_request()
+                except Exception as e:
+                    error = e
+                    response = app.handle_exception(e)
+                return response
+            finally:
+                if "werkzeug.debug.preserve_context" in environ:
+                    environ["werkzeug.debug.preserve_context"](ctx)
+                ctx.pop(error)
+
+    def _open_session(self, req: Request) -> SessionMixin:
+        app = self.app
+        session = app.session_interface.open_session(app, req)
+        # Stored sessions are loaded from the database. Return the
+        # connection to the pool instead of holding it while the view waits.
+        db.session.close()
+        if session is None:
+            session = app.session_interface.make_null_session(app)
+        return session
+
+    async def _full_dispatch_request(self) -> Response:
+        app = self.app
+        try:
+            request_started.send(app, _async_wrapper=app.ensure_sync)
+            rv = app.preprocess_request()
+            if rv is None:
+                rv = await self._dispatch_request()
+        except Exception as e:
+            rv = app.handle_user_exception(e)
+
+        response = app.make_response(rv)
+        # Saves the session.
+        response = await asyncio.to_thread(app.process_response, response)
+        request_finished.send(app, _async_wrapper=app.ensure_sync,
+                              response=response)
+        return response
+
+    async def _dispatch_request(self):
+        if request.routing_exception is not None:
+            self.app.raise_routing_exception(request)
+        rule = request.url_rule
+        if (getattr(rule, "provide_automatic_options", False)
+                and request.method == "OPTIONS"):
+            return self.app.make_default_options_response()
+
+        rv = self.app.view_functions[rule.endpoint](**request.view_args)
+        if inspect.isawaitable(rv):
+            rv = await rv
+        return rv
+
+    @staticmethod
+    async def _read_body(receive) -> io.BytesIO | None:
+        body = io.BytesIO()
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return None
+            body.write(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        body.seek(0)
+        return body
+
+    @staticmethod
+    def _replay(body: io.BytesIO):
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body.getvalue(),
+                        "more_body": False}
+            return {"type": "http.disconnect"}
+        return receive
+
+    @staticmethod
+    async def _send_response(response: Response, environ, send) -> None:
+        headers = response.get_wsgi_headers(environ)
+        await send({
+            "type": "http.response.start",
+            "status": response.status_code,
+            "headers": [
+                (name.lower().encode("latin1"), value.encode("latin1"))
+                for name, value in headers.items()
+            ],
+        })
+        # Empty for HEAD requests and responses without a body.
+        app_iter = response.get_app_iter(environ)
+        try:
+            for chunk in app_iter:
+                await send({"type": "http.response.body", "body": chunk,
+                            "more_body": True})
+        finally:
+            if hasattr(app_iter, "close"):
+                app_iter.close()
+        await send({"type": "http.response.body"})
 
 
-def create_app() -> WsgiToAsgi:
+def create_app() -> AsgiApp:
     """Return an ASGI application."""
-    return WsgiToAsgi(create_wsgi_app())
+    return AsgiApp(create_wsgi_app())
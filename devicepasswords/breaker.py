@@ -0,0 +1,66 @@
+# SPDX-License-Identifier: MPL-2.0
+"""
+Circuit breaker.
+
+If a service fails repeatedly, e.g. the OIDC provider is overloaded,
+waiting for it only piles up requests. After a number of consecutive
+failures the circuit opens, and requests to the service fail immediately.
+After a while, a single trial request is let through: if it succeeds, the
+circuit closes again.
+"""
+import time
+
+
+class CircuitOpenError(IOError):
+    """The service failed repeatedly, requests to it are not sent."""
+
+
+class CircuitBreaker:
+    """Circuit breaker of the requests to a service."""
+
+    def __init__(self, threshold: int = 5, reset_timeout: float = 30):
+        #: Consecutive failures opening the circuit, 0 to never open it.
+        self.threshold = threshold
+        #: Seconds until a trial request is sent to the failing service.
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened_at: float | None = None
+        self._trial_at: float | None = None
+
+    @property
+    def open(self) -> bool:
+        """Return whether requests fail immediately."""
+        if self._opened_at is None:
+            return False
+        return (time.monotonic() - self._opened_at < self.reset_timeout or
+                self._trial_pending())
+
+    def _trial_pending(self) -> bool:
+        # A lost trial, e.g. of a cancelled request, expires.
+        return (self._trial_at is not None and
+                time.monotonic() - self._trial_at < self.reset_timeout)
+
+    def before_request(self) -> None:
+        """Check whether a request may be sent.
+
+        :raise CircuitOpenError: if the circuit is open.
+        """
+        if self._opened_at is None:
+            return
+        if self.open:
+            raise CircuitOpenError("Circuit open after %d failures." %
+                                   self.failures)
+        self._trial_at = time.monotonic()
+
+    def success(self) -> None:
+        """Record a successful request, and close the circuit."""
+        self.failures = 0
+        self._opened_at = self._trial_at = None
+
+    def failure(self) -> None:
+        """Record a failed request, and open the circuit if it failed too
+        often."""
+        self.failures += 1
+        self._trial_at = None
+        if self.threshold and self.failures >= self.threshold:
+            self._opened_at = time.monotonic()
@@ -0,0 +1,83 @@
+# SPDX-License-Identifier: MPL-2.0
+"""
+Calibration of password hash costs.
+
+The cost of a hash (rounds) is chosen such that a single verification
+takes at most a given time on the current hardware. The memory cost of
+memory-hard hashes is kept, so that it is not traded for time.
+"""
+import statistics
+import time
+
+from .pwdhash import hasher
+
+SECRET = "calibration-password-12345"
+
+
+def _duration(handler, **settings) -> float:
+    """Return the median duration in seconds of hashing with settings."""
+    custom = handler.using(relaxed=True, **settings)
+    durations = []
+    for _ in range(3):
+        start = time.perf_counter()
+        custom.hash(SECRET)
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def _calibrate_argon2(handler, target: float) -> dict:
+    # The hash process pool already uses all cores, additional lanes would
+    # only compete for them.
+    # The memory cost is kept as configured, e.g. by
+    # DP_PASSWORD_HASH_SETTINGS, only the rounds are calibrated.
+    settings = {"parallelism": 1, "memory_cost": handler.memory_cost}
+    duration = _duration(handler, default_rounds=1, **settings)
+    settings["default_rounds"] = max(1, int(target / duration))
+    return settings
+
+
+def _calibrate_log2(handler, target: float) -> dict:
+    rounds = handler.min_rounds
+    while (rounds < handler.max_rounds and
+           _duration(handler, default_rounds=rounds + 1) <= target):
+        rounds += 1
+    return {"default_rounds": rounds}
+
+
+def _calibrate_linear(handler, target: float) -> dict:
+    rounds = max(handler.min_rounds, (handler.default_rounds or 0) // 16, 1)
+    duration = _duration(handler, default_rounds=rounds)
+    rounds = int(rounds * target / duration)
+    # The estimate is only linear approximately, decrease until it fits.
+    while (rounds > handler.min_rounds and
+           _duration(handler, default_rounds=rounds) > target):
+        rounds = int(rounds * 0.9)
+    return {"default_rounds": min(max(rounds, handler.min_rounds),
+                                  handler.max_rounds)}
+
+
+def calibrate(scheme: str, target: float) -> dict:
+    """Return the CryptContext settings of a scheme such that hashing and
+    verifying takes at most target seconds.
+
+    Schemes without a configurable cost return no settings.
+    """
+    handler = hasher.handler(scheme)
+    if handler.name == "argon2":
+        settings = _calibrate_argon2(handler, target)
+    elif getattr(handler, "rounds_cost", None) == "log2":
+        settings = _calibrate_log2(handler, target)
+    elif getattr(handler, "rounds_cost", None) == "linear":
+        settings = _calibrate_linear(handler, target)
+    else:
+        settings = {}
+
+    return {f"{scheme}__{key}": value for key, value in settings.items()}
+
+
+def calibrate_all(schemes: list[str], target: float) -> dict:
+    """Return the CryptContext settings of multiple schemes."""
+    settings = {}
+    for scheme in dict.fromkeys(schemes):
+        settings.update(calibrate(scheme, target))
+    return settings
@@ -0,0 +1,100 @@
+# SPDX-License-Identifier: MPL-2.0
+"""
+Command line interface.
+
+All commands are available as ``flask devicepasswords <command>``.
+"""
+import json
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy.exc import IntegrityError
+
+from .calibrate import calibrate_all
+from .devpwd import device_passwords
+from .provision import (provision as provision_tokens, read_records,
+                        write_records)
+from .retention import sweep as sweep_expired
+from .usage import rollup as rollup_logs
+
+commands = AppGroup("devicepasswords",
+                    help="Manage the device password service.")
+
+
+@commands.command("calibrate")
+@click.option("--target", type=float, default=50, show_default=True,
+              help="Maximum duration of a verification in milliseconds.")
+@click.option("--scheme", "schemes", multiple=True,
+              help="Scheme to calibrate, defaults to DP_PASSWORD_HASH and "
+                   "DP_PASSWORD_HASHES.")
+def calibrate(target, schemes):
+    """Print password hash settings meeting a latency target.
+
+    The output is suitable as value of DP_PASSWORD_HASH_SETTINGS.
+    """
+    schemes = schemes or [current_app.config["PASSWORD_HASH"],
+                          *current_app.config["PASSWORD_HASHES"]]
+    click.echo(json.dumps(calibrate_all(schemes, target / 1000)))
+
+
+@commands.command("sweep")
+@click.option("--batch-size", type=int,
+              help="Rows deleted per transaction, defaults to "
+                   "DP_SWEEP_BATCH_SIZE.")
+def sweep(batch_size):
+    """Delete expired revocations and sessions."""
+    batch_size = batch_size or int(current_app.config["SWEEP_BATCH_SIZE"])
+    for table, deleted in sweep_expired(batch_size).items():
+        click.echo(f"{table}: {deleted} expired rows deleted")
+
+
+@commands.command("rollup")
+@click.option("--keep-days", type=int, default=30, show_default=True,
+              help="Days of raw log entries to keep.")
+@click.option("--batch-size", type=int, default=1000, show_default=True,
+              help="Log entries rolled up per transaction.")
+def rollup(keep_days, batch_size):
+    """Roll up old log entries into daily use counts."""
+    rolled_up = rollup_logs(datetime.now() - timedelta(days=keep_days),
+                            batch_size)
+    click.echo(f"{rolled_up} log entries rolled up")
+
+
+@commands.command("generate")
+@click.argument("count", type=int)
+@click.option("--batch-size", type=int, default=1024, show_default=True,
+              help="Passwords generated at once.")
+def generate(count, batch_size):
+    """Print COUNT device passwords, one per line."""
+    while count > 0:
+        batch = device_passwords.generate_many(min(count, batch_size))
+        click.echo("\n".join(batch))
+        count -= len(batch)
+
+
+@commands.command("provision")
+@click.argument("source", type=click.File("r"), default="-")
+@click.option("--format", "fmt", type=click.Choice(["csv", "ndjson"]),
+              default="csv", show_default=True,
+              help="Format of the input and the output.")
+@click.option("--wordlist", help="Wordlist of the passwords.")
+@click.option("--batch-size", type=int, default=100, show_default=True,
+              help="Tokens created per transaction.")
+def provision(source, fmt, wordlist, batch_size):
+    """Create device passwords for the users in SOURCE.
+
+    Each record has the fields sub, username, email, name (of the device
+    password) and optionally expires (ISO date). The records are printed
+    with their login and secret once they are stored.
+    """
+    if wordlist is not None and wordlist not in device_passwords.wordlists:
+        raise click.BadParameter(f"Unknown wordlist {wordlist}",
+                                 param_hint="--wordlist")
+    try:
+        write_records(click.get_text_stream("stdout"), fmt, provision_tokens(
+            read_records(source, fmt), batch_size, wordlist
+        ))
+    except (ValueError, IntegrityError) as e:
+        raise click.ClickException(str(e))
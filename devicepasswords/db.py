@@ -3,11 +3,12 @@
 Database schema classes.
 """
 import uuid
-from datetime import datetime
+from datetime import datetime, date
 from typing import List
 
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Integer, String, ForeignKey, DateTime, Uuid
+from sqlalchemy import (Integer, String, ForeignKey, Date, DateTime, Uuid,
+                        Index)
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -39,17 +40,57 @@ class Token(db.Model):
     name: Mapped[str] = mapped_column(String, nullable=False)
     token: Mapped[str] = mapped_column(String, nullable=False)
     expires: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    last_used: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    uses: Mapped[int] = mapped_column(Integer, nullable=False, default=0,
+                                      server_default="0")
+
+    hashes: Mapped[List["TokenHash"]] = relationship(
+        cascade="all, delete-orphan"
+    )
+
+
+class TokenHash(db.Model):
+    """Hashes of tokens in additional schemes."""
+    __tablename__ = "token_hashes"
+
+    tokenId: Mapped[Uuid] = mapped_column(
+        ForeignKey("tokens.id", ondelete="CASCADE"), primary_key=True
+    )
+    scheme: Mapped[str] = mapped_column(String, primary_key=True)
+    hash: Mapped[str] = mapped_column(String, nullable=False)
 
 
 class Log(db.Model):
     __tablename__ = "logs"
+    __table_args__ = (Index("ix_logs_tokenId_date", "tokenId", "date"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     date: Mapped[datetime] = mapped_column(DateTime, nullable=False)
     tokenId: Mapped[Uuid] = mapped_column(ForeignKey("tokens.id"))
 
 
+class Usage(db.Model):
+    """Daily use counts of tokens, rolled up from the logs."""
+    __tablename__ = "usage"
+
+    tokenId: Mapped[Uuid] = mapped_column(
+        ForeignKey("tokens.id", ondelete="CASCADE"), primary_key=True
+    )
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, nullable=False)
+
+
 class Revoked(db.Model):
     __tablename__ = "revoked"
 
     sid: Mapped[str] = mapped_column(String, primary_key=True)
+    expires: Mapped[datetime] = mapped_column(DateTime, nullable=True,
+                                              index=True)
+
+
+class Version(db.Model):
+    """Change counters of tables, e.g. to invalidate caches."""
+    __tablename__ = "versions"
+
+    name: Mapped[str] = mapped_column(String, primary_key=True)
+    value: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
@@ -3,55 +3,118 @@
 Device password generation.
 """
 import math
-import random
+import os
+from collections.abc import Sequence
 
 from flask import Flask
 
-wordlist = []
+from .wordlists import compile_wordlists, load_wordlists
+
+
+def random_below(bound: int, count: int) -> list[int]:
+    """Return count uniformly distributed random integers in [0, bound).
+
+    Entropy is read from the OS in blocks. Values are drawn by rejection
+    sampling, so that they are not biased by the modulo operation.
+
+    :raise ValueError: if bound is not within 1 and 2**32.
+    """
+    if not 1 <= bound <= 1 << 32:
+        raise ValueError(f"Bound {bound} not within 1 and 2**32.")
+    size = 1 if bound <= 1 << 8 else 2 if bound <= 1 << 16 else 4
+    fmt = {1: "B", 2: "H", 4: "I"}[size]
+    # Values at or above limit would be biased and are rejected.
+    limit = (1 << (8 * size)) // bound * bound
+    # Expected rejections plus a margin to avoid a second read.
+    expected = math.ceil(count * (1 << (8 * size)) / limit) + 16
+
+    values = []
+    while len(values) < count:
+        block = memoryview(os.urandom(expected * size)).cast(fmt)
+        values.extend(value % bound for value in block if value < limit)
+    return values[:count]
 
 
 class DevicePasswords:
-    """Device password generator from list."""
-    secure = random.SystemRandom()
-    wordcount: int
+    """Device password generator from lists of words.
+
+    Several wordlists, e.g. one per language, may be registered by name. The
+    first one is the default.
+    """
 
-    def __init__(self, words: list[str] = None, digits=5, entropy=64):
-        self.words = words or []
+    def __init__(self, words: Sequence[str] = None, digits=5, entropy=64):
+        self.wordlists: dict[str, Sequence[str]] = {}
+        self.wordcounts: dict[str, int] = {}
 
         self.digits = digits
         self.entropy = entropy
         if words:
-            self.calculate_wordcount()
+            self.add_wordlist("default", words)
 
-    def calculate_wordcount(self):
+    @property
+    def words(self) -> Sequence[str]:
+        """Words of the default wordlist."""
+        return next(iter(self.wordlists.values()), ())
+
+    @property
+    def wordcount(self) -> int:
+        """Words per password of the default wordlist."""
+        return next(iter(self.wordcounts.values()))
+
+    def calculate_wordcount(self, words: Sequence[str]) -> int:
         """Calculate the required words."""
-        self.wordcount = int(math.ceil(
+        return int(math.ceil(
             (self.entropy - math.log2(10) * self.digits) /
-             math.log2(len(self.words))
+             math.log2(len(words))
         ))
 
-    def generate(self) -> str:
+    def add_wordlist(self, name: str, words: Sequence[str]) -> None:
+        """Register a wordlist."""
+        self.wordlists[name] = words
+        self.wordcounts[name] = self.calculate_wordcount(words)
+
+    def generate(self, wordlist: str | None = None) -> str:
         """Generate device password consisting of words and numbers, joined by
         dashes."""
-        return "-".join(
-            self.secure.choice(self.words).strip() for _ in range(
-                self.wordcount
-            )
-        ) + "-" + self.random_digits(self.digits)
+        return self.generate_many(1, wordlist)[0]
+
+    def generate_many(self, n: int, wordlist: str | None = None) -> list[str]:
+        """Generate n device passwords with a single read of entropy for the
+        words and the digits each.
+
+        Raise KeyError for an unknown wordlist.
+        """
+        wordlist = wordlist or next(iter(self.wordlists))
+        words = self.wordlists[wordlist]
+        wordcount = self.wordcounts[wordlist]
+        indices = random_below(len(words), n * wordcount)
+        digits = "".join(map(str, random_below(10, n * self.digits)))
+
+        return [
+            "-".join(
+                words[index] for index in
+                indices[i * wordcount:(i + 1) * wordcount]
+            ) + "-" + digits[i * self.digits:(i + 1) * self.digits]
+            for i in range(n)
+        ]
 
     def init_app(self, app: Flask) -> None:
-        with open(app.config["WORDLIST"]) as wl:
-            self.words = [line.strip() for line in wl.readlines()]
+        sources = app.config["WORDLISTS"] or {
+            "default": app.config["WORDLIST"]
+        }
+        path = compile_wordlists(sources, app.config["WORDLIST_CACHE_DIR"] or
+                                 app.config["RUNTIME_DIR"])
 
         self.entropy = app.config["PASSWORD_ENTROPY"]
-        self.calculate_wordcount()
+        self.wordlists.clear()
+        self.wordcounts.clear()
+        for name, words in load_wordlists(path).items():
+            self.add_wordlist(name, words)
 
     @classmethod
     def random_digits(cls, amount: int) -> str:
         """Generates 'amount' random digits."""
-        return "".join(
-            str(cls.secure.randint(0, 9)) for _ in range(amount)
-        )
+        return "".join(map(str, random_below(10, amount)))
 
 
 device_passwords = DevicePasswords()
@@ -0,0 +1,26 @@
+# SPDX-License-Identifier: MPL-2.0
+"""
+Expiration dates of device passwords.
+"""
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+
+
+def limit_expiration(expires: date | None) -> date | None:
+    """Return the expiration date limited by the maximum expiration."""
+    if (expiration := current_app.config["PASSWORD_MAX_EXPIRATION_DAYS"]) > 0:
+        maximum = (datetime.now() + timedelta(days=expiration)).date()
+        if expires is None or expires > maximum:
+            return maximum
+    return expires
+
+
+def parse_expiration(value: object) -> date | None:
+    """Return the expiration date of an ISO date, or None if empty, limited
+    by the maximum expiration. Raise ValueError for invalid dates."""
+    if value is None or value == "":
+        return limit_expiration(None)
+    if not isinstance(value, str):
+        raise ValueError(f"Invalid date {value!r}")
+    return limit_expiration(date.fromisoformat(value))
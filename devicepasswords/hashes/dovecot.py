@@ -6,72 +6,104 @@ The format is:
 
 {SCRAM-SHA-bits},rounds,base64(salt),base64(stored_key),base64(server_key)
 """
+import binascii
+import hashlib
 import hmac
 from base64 import b64encode, b64decode
+from functools import lru_cache
 from secrets import token_bytes
-from typing import Literal
-
-import hashlib
 
-from passlib.hash import scram
+from passlib.utils import saslprep
 from passlib.utils.handlers import GenericHandler
-from passlib.ifc import PasswordHash
 
 ROUNDS = 200_000
 CLIENT_KEY = b"Client Key"
 SERVER_KEY = b"Server Key"
 
 
-def _dovecot_scram(password: str, alg: Literal["sha-1", "sha-256", "sha-512"],
-                   salt: bytes|None = None, rounds: int = ROUNDS) -> str:
-    if salt is None:
-        salt = token_bytes(16)
-    digest = scram.derive_digest(password, salt, rounds, alg)
-    serverkey = hmac.digest(digest, SERVER_KEY, alg)
-    clientkey = hmac.digest(digest, CLIENT_KEY, alg)
-    storedkey = hashlib.new(alg, clientkey, usedforsecurity=True).digest()
+def _salted_password(password: str | bytes, digest: str, salt: bytes,
+                     rounds: int) -> bytes:
+    """Return SaltedPassword := Hi(Normalize(password), salt, i)."""
+    if isinstance(password, bytes):
+        password = password.decode("utf-8")
+    return hashlib.pbkdf2_hmac(digest, saslprep(password).encode("utf-8"),
+                               salt, rounds)
 
-    return ",".join((
-        f"{{SCRAM-{alg.upper()}}}{rounds}",
-        b64encode(salt).decode(),
-        b64encode(storedkey).decode(),
-        b64encode(serverkey).decode()
-    ))
+
+def _stored_key(salted_password: bytes, digest: str) -> bytes:
+    """Return StoredKey := H(HMAC(SaltedPassword, "Client Key"))."""
+    client_key = hmac.digest(salted_password, CLIENT_KEY, digest)
+    return hashlib.new(digest, client_key).digest()
 
 
 class DovecotSCRAMSHA256(GenericHandler):
     name = "dovecot_scram_sha256"
-    _algorithm = "sha-256"
+    ident = "{SCRAM-SHA-256}"
+    _digest = "sha256"
     setting_kwds = ("rounds", "salt")
 
+    default_rounds = ROUNDS
+    min_rounds = 4096
+    max_rounds = 2 ** 32 - 1
+    rounds_cost = "linear"
+
     @classmethod
-    def hash(cls, secret, **setting_and_context_kwds):
-        return _dovecot_scram(secret, cls._algorithm,
-                              **setting_and_context_kwds)
+    def hash(cls, secret, salt: bytes | None = None, rounds: int | None = None,
+             **context_kwds):
+        if salt is None:
+            salt = token_bytes(16)
+        if rounds is None:
+            rounds = cls.default_rounds
+        salted_password = _salted_password(secret, cls._digest, salt, rounds)
+        server_key = hmac.digest(salted_password, SERVER_KEY, cls._digest)
+
+        return ",".join((
+            f"{cls.ident}{rounds}",
+            b64encode(salt).decode(),
+            b64encode(_stored_key(salted_password, cls._digest)).decode(),
+            b64encode(server_key).decode()
+        ))
 
     @classmethod
     def verify(cls, secret, hash, **context_kwds):
-        if not cls.identify(hash):
+        if (parsed := cls._parse(hash)) is None:
             return False
 
-        rounds, salt, _, _ = hash.split(",")
+        rounds, salt, stored_key = parsed
+        salted_password = _salted_password(secret, cls._digest, salt, rounds)
+        return hmac.compare_digest(
+            _stored_key(salted_password, cls._digest), stored_key
+        )
+
+    @classmethod
+    @lru_cache(maxsize=1024)
+    def _parse(cls, hash) -> tuple[int, bytes, bytes] | None:
+        """Return rounds, salt and stored key of a hash, or None if the hash
+        is malformed."""
+        if not cls.identify(hash):
+            return None
+
         try:
-            rounds = int(rounds[len(f"{{SCRAM-{cls._algorithm}}}"):])
-        except ValueError:
-            return False
-        digest = cls.hash(secret, salt=b64decode(salt), rounds=rounds)
-        print(digest)
-        return hmac.compare_digest(digest, hash)
+            rounds, salt, stored_key, _ = hash[len(cls.ident):].split(",")
+            if int(rounds) < 1:
+                return None
+            return int(rounds), b64decode(salt), b64decode(stored_key)
+        except (ValueError, binascii.Error):
+            return None
 
     @classmethod
-    def using(cls, relaxed=False, **kwds):
-        return cls()
+    def using(cls, relaxed=False, default_rounds=None, rounds=None, **kwds):
+        subcls = type(cls.__name__, (cls,), {"__module__": cls.__module__})
+        if (rounds := default_rounds or rounds) is not None:
+            subcls.default_rounds = int(rounds)
+        return subcls
 
     @classmethod
     def identify(cls, hash):
-        return hash.startswith(f"{{SCRAM-{cls._algorithm.upper()}}}")
+        return hash.startswith(cls.ident)
 
 
 class DovecotSCRAMSHA1(DovecotSCRAMSHA256):
     name = "dovecot_scram_sha1"
-    _algorithm = "sha-1"
+    ident = "{SCRAM-SHA-1}"
+    _digest = "sha1"
@@ -0,0 +1,95 @@
+# SPDX-License-Identifier: MPL-2.0
+"""
+Password hashing off the event loop.
+
+Modern password hashes are CPU bound by design. Computing them inline
+blocks the event loop of the worker for every other request, so they are
+computed in a bounded process pool instead.
+"""
+import asyncio
+import itertools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator
+
+from flask import Flask
+
+from .metrics import metrics
+from .pwdhash import hasher, configure
+
+
+def _hash(secret: str, scheme: str) -> str:
+    return hasher.hash(secret, scheme=scheme)
+
+
+def _verify(secret: str, hash: str, scheme: str) -> bool:
+    return hasher.verify(secret, hash, scheme=scheme)
+
+
+class HashPool:
+    """Process pool computing and verifying password hashes."""
+    workers: int = 1
+
+    _executor: ProcessPoolExecutor | None = None
+    _pid: int | None = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        """Return the process pool of the current process.
+
+        The pool is recreated if the process was forked after the pool was
+        started, e.g. by gunicorn with preloading enabled. Workers use the
+        settings of the hasher at the time the pool is started.
+        """
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=configure,
+                initargs=(hasher.to_dict(),),
+            )
+            self._pid = os.getpid()
+        return self._executor
+
+    async def hash(self, secret: str, scheme: str) -> str:
+        """Hash a secret with the given scheme."""
+        with metrics.time_hash(scheme, "hash"):
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, _hash, secret, scheme
+            )
+
+    async def verify(self, secret: str, hash: str, scheme: str) -> bool:
+        """Verify a secret against a hash of the given scheme.
+
+        The scheme cannot be detected reliably, as e.g. any value is a valid
+        plaintext "hash".
+        """
+        with metrics.time_hash(scheme, "verify"):
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, _verify, secret, hash, scheme
+            )
+
+    def hash_many(self, secrets: list[str], scheme: str) -> Iterator[str]:
+        """Hash secrets with the given scheme on all workers, in order.
+
+        Blocks, for use outside of the event loop, e.g. by commands.
+        """
+        return self.executor.map(
+            _hash, secrets, itertools.repeat(scheme),
+            chunksize=max(1, len(secrets) // (4 * self.workers))
+        )
+
+    def shutdown(self) -> None:
+        """Stop the worker processes."""
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+    def init_app(self, app: Flask) -> None:
+        self.workers = int(app.config["HASH_WORKERS"]) or os.cpu_count() or 1
+        self.shutdown()
+        _ = self.executor
+
+
+hash_pool = HashPool()
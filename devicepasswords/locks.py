@@ -0,0 +1,179 @@
+# SPDX-License-Identifier: MPL-2.0
+"""
+Locks shared by the workers and replicas.
+
+The advisory locks of the database are used where supported. Otherwise,
+e.g. for SQLite, a lock file in the private runtime directory is used,
+which only works for workers on the same host.
+
+Locks are acquired by polling, so that waiting for a lock neither blocks a
+thread nor the event loop, and the timeout applies to every backend. Use
+them with ``with`` in threads and with ``async with`` on event loops.
+"""
+import asyncio
+import fcntl
+import hashlib
+import os
+import time
+
+import sqlalchemy as sa
+from flask import current_app
+
+from .db import db
+from .runtime import open_private, private_directory
+
+#: Default seconds to wait for a lock.
+LOCK_TIMEOUT = 300
+#: Seconds between attempts to acquire a held lock.
+POLL_INTERVAL = 0.1
+
+
+class LockTimeoutError(TimeoutError):
+    """The lock was not acquired within the timeout."""
+
+
+class PollingLock:
+    """Lock acquired by polling a non-blocking attempt."""
+
+    def __init__(self, name: str, timeout: float = LOCK_TIMEOUT):
+        self.name = name
+        self.timeout = timeout
+
+    def _try_acquire(self) -> bool:
+        """Acquire the lock if free, return whether it was acquired. May
+        block on I/O briefly, but not for the lock."""
+        raise NotImplementedError
+
+    def _release(self) -> None:
+        """Release the lock, or abandon a failed attempt."""
+        raise NotImplementedError
+
+    def _timed_out(self) -> LockTimeoutError:
+        self._release()
+        return LockTimeoutError(f"Cannot acquire the lock {self.name}.")
+
+    def __enter__(self) -> None:
+        deadline = time.monotonic() + self.timeout
+        while not self._try_acquire():
+            if time.monotonic() >= deadline:
+                raise self._timed_out()
+            time.sleep(POLL_INTERVAL)
+
+    def __exit__(self, *exc_info) -> None:
+        self._release()
+
+    async def _try_acquire_async(self) -> bool:
+        attempt = asyncio.ensure_future(asyncio.to_thread(self._try_acquire))
+        try:
+            return await asyncio.shield(attempt)
+        except asyncio.CancelledError:
+            # Release the lock if acquired despite the cancellation.
+            if await attempt:
+                await asyncio.to_thread(self._release)
+            raise
+
+    async def __aenter__(self) -> None:
+        deadline = time.monotonic() + self.timeout
+        while not await self._try_acquire_async():
+            if time.monotonic() >= deadline:
+                raise await asyncio.to_thread(self._timed_out)
+            await asyncio.sleep(POLL_INTERVAL)
+
+    async def __aexit__(self, *exc_info) -> None:
+        await asyncio.to_thread(self._release)
+
+
+class FileLock(PollingLock):
+    """Lock file of a private directory."""
+
+    _fd: int | None = None
+
+    def __init__(self, path: str, timeout: float = LOCK_TIMEOUT):
+        super().__init__(path, timeout)
+        self.path = path
+
+    def _try_acquire(self) -> bool:
+        if self._fd is None:
+            private_directory(os.path.dirname(self.path) or ".")
+            self._fd = open_private(self.path, os.O_WRONLY | os.O_CREAT)
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    def _release(self) -> None:
+        if self._fd is not None:
+            # Closing releases the lock.
+            os.close(self._fd)
+            self._fd = None
+
+
+class DatabaseLock(PollingLock):
+    """Advisory lock of the database, held by a connection."""
+
+    _connection: sa.Connection | None = None
+
+    def __init__(self, name: str, timeout: float = LOCK_TIMEOUT):
+        super().__init__(name, timeout)
+        self.params = {"name": name}
+        match db.engine.dialect.name:
+            case "postgresql":
+                self.params = {"key": int.from_bytes(
+                    hashlib.sha256(name.encode()).digest()[:8], "big",
+                    signed=True
+                )}
+                self.acquire = sa.text(
+                    "SELECT CAST(pg_try_advisory_lock(:key) AS integer)"
+                )
+                self.release = sa.text("SELECT pg_advisory_unlock(:key)")
+            case "mysql" | "mariadb":
+                self.acquire = sa.text("SELECT GET_LOCK(:name, 0)")
+                self.release = sa.text("SELECT RELEASE_LOCK(:name)")
+            case "mssql":
+                self.acquire = sa.text(
+                    "DECLARE @result int; "
+                    "EXEC @result = sp_getapplock @Resource = :name, "
+                    "@LockMode = 'Exclusive', @LockOwner = 'Session', "
+                    "@LockTimeout = 0; "
+                    "SELECT CASE WHEN @result >= 0 THEN 1 ELSE 0 END"
+                )
+                self.release = sa.text(
+                    "EXEC sp_releaseapplock @Resource = :name, "
+                    "@LockOwner = 'Session'"
+                )
+        self._held = False
+
+    def _try_acquire(self) -> bool:
+        if self._connection is None:
+            self._connection = db.engine.connect().execution_options(
+                isolation_level="AUTOCOMMIT"
+            )
+        self._held = self._connection.execute(
+            self.acquire, self.params
+        ).scalar() == 1
+        return self._held
+
+    def _release(self) -> None:
+        if self._connection is None:
+            return
+        try:
+            if self._held:
+                self._connection.execute(self.release, self.params)
+        finally:
+            self._held = False
+            self._connection.close()
+            self._connection = None
+
+
+def named_lock(name: str, timeout: float = LOCK_TIMEOUT) -> PollingLock:
+    """Return the named lock, an advisory lock of the database where
+    supported, or a lock file otherwise. Needs the app context."""
+    if db.engine.dialect.name in ("postgresql", "mysql", "mariadb", "mssql"):
+        return DatabaseLock(name, timeout)
+
+    # Databases without locks, e.g. SQLite, are only shared by processes of
+    # the same host.
+    digest = hashlib.sha256(str(db.engine.url).encode()).hexdigest()[:16]
+    return FileLock(os.path.join(current_app.config["RUNTIME_DIR"],
+                                 f"{name}-{digest}.lock"), timeout)
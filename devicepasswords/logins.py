@@ -0,0 +1,80 @@
+# SPDX-License-Identifier: MPL-2.0
+"""
+Allocation of unique login names.
+
+A login is the username followed by random digits, e.g. ``alice#123``.
+A batch of candidates is checked with a single query. If all of them are
+taken, the namespace of the user is almost full and the next batch uses
+an additional digit.
+"""
+import secrets
+
+from sqlalchemy.orm import Session
+
+from .adb import adb
+from .db import db, Token
+from .devpwd import DevicePasswords
+
+CANDIDATES = 16
+MIN_DIGITS = 3
+MAX_DIGITS = 9
+
+
+def candidates(username: str, digits: int) -> set[str]:
+    """Return random login candidates for a user."""
+    return {
+        f"{username}#{DevicePasswords.random_digits(digits)}"
+        for _ in range(CANDIDATES)
+    }
+
+
+def free_logins(session: Session, logins: set[str]) -> set[str]:
+    """Return the logins not used by any token."""
+    return logins - set(session.execute(
+        db.select(Token.login).filter(Token.login.in_(logins))
+    ).scalars())
+
+
+def logins_taken(session: Session, logins: list[str]) -> bool:
+    """Return whether any of the logins is used by a token, e.g. to tell
+    whether an IntegrityError was caused by a login taken concurrently."""
+    return free_logins(session, set(logins)) != set(logins)
+
+
+def allocate_logins_sync(session: Session,
+                         usernames: list[str]) -> list[str | None]:
+    """Return distinct unused logins for users, with None for each user no
+    login was found for.
+
+    The candidates of all users are checked with a single query per round.
+    """
+    logins: list[str | None] = [None] * len(usernames)
+    allocated = set()
+    for digits in range(MIN_DIGITS, MAX_DIGITS + 1):
+        if not (pending := [i for i, login in enumerate(logins)
+                            if login is None]):
+            break
+
+        choices = {i: candidates(usernames[i], digits) for i in pending}
+        free = free_logins(session, set().union(*choices.values()))
+        free -= allocated
+        for i in pending:
+            if available := choices[i] & free:
+                logins[i] = secrets.choice(sorted(available))
+                free.discard(logins[i])
+                allocated.add(logins[i])
+    return logins
+
+
+def allocate_login_sync(session: Session, username: str) -> str | None:
+    """Return an unused login for a user, or None if none was found."""
+    return allocate_logins_sync(session, [username])[0]
+
+
+async def allocate_login(username: str) -> str | None:
+    """Return an unused login for a user, or None if none was found.
+
+    The login may be taken concurrently until the token is committed,
+    which then fails with an IntegrityError, see logins_taken.
+    """
+    return await adb.run(allocate_login_sync, username)
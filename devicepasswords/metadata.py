@@ -0,0 +1,55 @@
+# SPDX-License-Identifier: MPL-2.0
+"""
+Shared cache of the OIDC provider metadata.
+
+The last fetched discovery document and keys are stored in a file, so
+that workers start without contacting the OIDC provider, and only one
+worker at a time fetches the metadata. The others wait for the lock and
+use the fetched metadata from the file. The file may be placed on a
+volume shared by several nodes that supports locks.
+
+The signing keys of the file are trusted, so the file and its directory
+must be owned by the service user and not writable by other users.
+"""
+import json
+import logging
+import os
+import tempfile
+
+from .locks import FileLock
+from .runtime import open_private, private_directory
+
+logger = logging.getLogger(__name__)
+
+
+class MetadataCache:
+    """File storing the metadata documents by URL."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def lock(self) -> FileLock:
+        """Return the exclusive lock of the fetching worker."""
+        return FileLock(self.path + ".lock")
+
+    def load(self) -> dict[str, dict]:
+        """Return the cached documents, or nothing if the file is missing,
+        unreadable or not private."""
+        try:
+            with open(open_private(self.path)) as f:
+                return json.load(f)
+        except PermissionError as e:
+            logger.warning("Ignoring the OIDC metadata cache: %s" % e)
+            return {}
+        except (OSError, ValueError):
+            return {}
+
+    def save(self, documents: dict[str, dict]) -> None:
+        """Replace the cached documents."""
+        private_directory(os.path.dirname(self.path) or ".")
+        # Created accessible by the service user only.
+        with tempfile.NamedTemporaryFile(
+                "w", dir=os.path.dirname(self.path) or ".", delete=False
+        ) as tmp:
+            json.dump(documents, tmp)
+        os.replace(tmp.name, self.path)
@@ -0,0 +1,271 @@
+# SPDX-License-Identifier: MPL-2.0
+"""
+Prometheus metrics.
+
+Optional, requires the prometheus_client package (the "metrics" extra).
+If enabled by DP_METRICS, the metrics are served at /metrics in the text
+exposition format. Each worker writes its metrics to files in
+DP_METRICS_DIR, which are aggregated when the metrics are scraped, so all
+workers are covered regardless of the worker serving the scrape.
+
+The directory is private, as its files are trusted. The files of previous
+server runs are deleted by the first worker of a new run, which is told
+apart by the process group of the server (e.g. of the gunicorn master) and
+its start time.
+
+Instrumented code calls the methods of the metrics singleton, which do
+nothing if metrics are disabled.
+"""
+import atexit
+import contextlib
+import hmac
+import os
+import threading
+import tempfile
+import time
+from typing import Iterator
+
+import sqlalchemy as sa
+from flask import (Flask, Response, abort, current_app, g,
+                   has_request_context, request, request_finished,
+                   request_started)
+
+from .locks import FileLock
+from .runtime import open_private, private_directory
+
+#: Buckets of request and database durations in seconds.
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5,
+                   10)
+#: Buckets of password hash durations in seconds.
+HASH_BUCKETS = (.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5)
+#: Buckets of database accesses per request.
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)
+
+
+def _server_run() -> str:
+    """Return an identifier of the server run shared by its workers: the
+    process group and the start time of its leader, if known."""
+    group = os.getpgid(0)
+    try:
+        with open(f"/proc/{group}/stat") as f:
+            started = f.read().rsplit(")", 1)[1].split()[19]
+    except (OSError, IndexError):
+        started = ""
+    return f"{group} {started}"
+
+
+def clear_stale(directory: str) -> None:
+    """Delete the metrics files of previous server runs. Must be called
+    before metrics are created."""
+    run = _server_run()
+    marker = os.path.join(directory, "run")
+    with FileLock(marker + ".lock"):
+        try:
+            with open(open_private(marker)) as f:
+                if f.read() == run:
+                    return
+        except FileNotFoundError:
+            pass
+        for name in os.listdir(directory):
+            if name.endswith(".db"):
+                os.remove(os.path.join(directory, name))
+        with tempfile.NamedTemporaryFile("w", dir=directory,
+                                         delete=False) as tmp:
+            tmp.write(run)
+        os.replace(tmp.name, marker)
+
+
+class Metrics:
+    """Prometheus metrics of the hot paths, aggregated across workers."""
+    enabled: bool = False
+
+    _created = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def _create(self, prometheus_client, directory: str) -> None:
+        """Create the metrics, once per process. They are not registered,
+        as they are collected from the files of all workers."""
+        histogram = prometheus_client.Histogram
+        counter = prometheus_client.Counter
+        self.requests = histogram(
+            "devicepasswords_request_duration_seconds",
+            "Duration of requests by view.", ["endpoint", "status"],
+            buckets=LATENCY_BUCKETS, registry=None,
+        )
+        self.request_db_accesses = histogram(
+            "devicepasswords_request_db_accesses",
+            "Database accesses of requests by view.", ["endpoint"],
+            buckets=COUNT_BUCKETS, registry=None,
+        )
+        self.request_db_seconds = histogram(
+            "devicepasswords_request_db_seconds",
+            "Time requests waited for the database by view.", ["endpoint"],
+            buckets=LATENCY_BUCKETS, registry=None,
+        )
+        self.queries = histogram(
+            "devicepasswords_db_query_duration_seconds",
+            "Duration of database queries.",
+            buckets=LATENCY_BUCKETS, registry=None,
+        )
+        self.hashes = histogram(
+            "devicepasswords_hash_duration_seconds",
+            "Duration of password hashes by scheme, including the wait for "
+            "a free hash worker.", ["scheme", "operation"],
+            buckets=HASH_BUCKETS, registry=None,
+        )
+        self.hash_pending = prometheus_client.Gauge(
+            "devicepasswords_hash_pending",
+            "Password hashes queued or computed by the hash workers.",
+            multiprocess_mode="livesum", registry=None,
+        )
+        self.idp_requests = histogram(
+            "devicepasswords_idp_request_duration_seconds",
+            "Duration of requests to the identity provider by endpoint.",
+            ["endpoint"], buckets=LATENCY_BUCKETS, registry=None,
+        )
+        self.idp_errors = counter(
+            "devicepasswords_idp_errors",
+            "Failed requests to the identity provider by endpoint.",
+            ["endpoint", "error"], registry=None,
+        )
+        self.revocation_lookups = counter(
+            "devicepasswords_revocation_lookups",
+            "Lookups of revoked sessions, answered by the cache (hit) or "
+            "the database (miss).", ["result"], registry=None,
+        )
+        sa.event.listen(sa.Engine, "before_cursor_execute",
+                        self._query_started)
+        sa.event.listen(sa.Engine, "after_cursor_execute",
+                        self._query_finished)
+        atexit.register(
+            prometheus_client.multiprocess.mark_process_dead, os.getpid(),
+            directory
+        )
+
+    def _request_started(self, app: Flask, **_) -> None:
+        g._metrics_start = time.perf_counter()
+        g._metrics_db = [0, 0.0]
+
+    def _request_finished(self, app: Flask, response: Response,
+                          **_) -> None:
+        if (start := g.get("_metrics_start")) is None:
+            return
+        endpoint = request.endpoint or "none"
+        self.requests.labels(endpoint, response.status_code).observe(
+            time.perf_counter() - start
+        )
+        accesses, seconds = g._metrics_db
+        self.request_db_accesses.labels(endpoint).observe(accesses)
+        self.request_db_seconds.labels(endpoint).observe(seconds)
+
+    @staticmethod
+    def _query_started(conn, cursor, statement, parameters, context,
+                       executemany) -> None:
+        conn.info.setdefault("metrics_start", []).append(time.perf_counter())
+
+    def _query_finished(self, conn, cursor, statement, parameters, context,
+                        executemany) -> None:
+        if starts := conn.info.get("metrics_start"):
+            self.queries.observe(time.perf_counter() - starts.pop())
+
+    @contextlib.contextmanager
+    def time_database(self) -> Iterator[None]:
+        """Measure a database access of the current request."""
+        if not self.enabled or not has_request_context():
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if (stats := g.get("_metrics_db")) is not None:
+                stats[0] += 1
+                stats[1] += time.perf_counter() - start
+
+    @contextlib.contextmanager
+    def time_hash(self, scheme: str, operation: str) -> Iterator[None]:
+        """Measure a password hash computed by the hash workers."""
+        if not self.enabled:
+            yield
+            return
+        self.hash_pending.inc()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.hash_pending.dec()
+            self.hashes.labels(scheme, operation).observe(
+                time.perf_counter() - start
+            )
+
+    def idp_request(self, endpoint: str, seconds: float,
+                    error: str | None = None) -> None:
+        """Record a request to the identity provider, and its error."""
+        if not self.enabled:
+            return
+        self.idp_requests.labels(endpoint).observe(seconds)
+        if error is not None:
+            self.idp_errors.labels(endpoint, error).inc()
+
+    def idp_rejected(self, endpoint: str) -> None:
+        """Record a request to the identity provider not sent, as the
+        circuit breaker is open."""
+        if self.enabled:
+            self.idp_errors.labels(endpoint, "circuit_open").inc()
+
+    def revocation_lookup(self, cached: bool) -> None:
+        """Record a lookup of a revoked session."""
+        if self.enabled:
+            self.revocation_lookups.labels("hit" if cached else "miss").inc()
+
+    def view(self):
+        """Serve the metrics of all workers."""
+        from prometheus_client import (CONTENT_TYPE_LATEST,
+                                       CollectorRegistry, generate_latest,
+                                       multiprocess)
+
+        if api_key := current_app.config.get("METRICS_API_KEY"):
+            authorization = request.headers.get("Authorization", "")
+            if not hmac.compare_digest(authorization.encode(),
+                                       f"Bearer {api_key}".encode()):
+                abort(401)
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry),
+                        content_type=CONTENT_TYPE_LATEST)
+
+    def init_app(self, app: Flask) -> None:
+        self.enabled = bool(app.config["METRICS"])
+        if not self.enabled:
+            return
+
+        directory = app.config["METRICS_DIR"] or os.path.join(
+            private_directory(app.config["RUNTIME_DIR"]), "metrics"
+        )
+        # Read when prometheus_client is imported.
+        directory = private_directory(
+            os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", directory)
+        )
+        try:
+            import prometheus_client
+            import prometheus_client.multiprocess  # noqa: F401
+        except ImportError:
+            app.logger.error("DP_METRICS requires prometheus_client, "
+                             "install devicepasswords[metrics].")
+            raise
+
+        with self._lock:
+            if not self._created:
+                clear_stale(directory)
+                self._create(prometheus_client, directory)
+                self._created = True
+
+        request_started.connect(self._request_started, app)
+        request_finished.connect(self._request_finished, app)
+        app.add_url_rule("/metrics", "metrics", self.view)
+
+
+metrics = Metrics()
@@ -0,0 +1,85 @@
+# SPDX-License-Identifier: MPL-2.0
+"""
+Database migration on startup.
+
+Workers first check whether the schema is at the head revision with a
+single query, and skip the migration machinery if it is. Otherwise one
+process migrates while holding a lock, and the others wait for it and
+find the schema upgraded afterwards.
+
+The head revisions of the migration scripts are cached in the runtime
+directory, as finding them imports all scripts.
+"""
+import glob
+import hashlib
+import json
+import os
+import tempfile
+
+import sqlalchemy as sa
+from flask import current_app
+from flask_alembic import Alembic
+
+from .db import db
+from .locks import named_lock
+from .runtime import open_private, private_directory
+
+#: Name of the lock of the migrating process.
+LOCK_NAME = "devicepasswords_migration"
+
+
+def current_revisions() -> set[str]:
+    """Return the revisions of the database schema, if any."""
+    with db.engine.connect() as connection:
+        if not sa.inspect(connection).has_table("alembic_version"):
+            return set()
+        return set(connection.execute(
+            sa.text("SELECT version_num FROM alembic_version")
+        ).scalars())
+
+
+def script_heads(alembic: Alembic) -> set[str]:
+    """Return the head revisions of the migration scripts, cached by the
+    names, sizes and modification times of the scripts."""
+    config = alembic.config
+    locations = (config.get_main_option("version_locations") or os.path.join(
+        config.get_main_option("script_location"), "versions"
+    ))
+    scripts = sorted(
+        script for location in locations.split(os.pathsep)
+        for script in glob.glob(os.path.join(location, "*.py"))
+    )
+    key = hashlib.sha256(json.dumps([
+        (script, os.stat(script).st_mtime_ns, os.stat(script).st_size)
+        for script in scripts
+    ]).encode()).hexdigest()
+    directory = private_directory(current_app.config["RUNTIME_DIR"])
+    path = os.path.join(directory, f"migrations-{key[:32]}.json")
+    try:
+        with open(open_private(path)) as f:
+            return set(json.load(f))
+    except FileNotFoundError:
+        pass
+
+    heads = alembic.script_directory.get_heads()
+    with tempfile.NamedTemporaryFile("w", dir=directory,
+                                     delete=False) as tmp:
+        json.dump(heads, tmp)
+    os.replace(tmp.name, path)
+    return set(heads)
+
+
+def at_head(alembic: Alembic) -> bool:
+    """Return whether the database schema is at the head revisions."""
+    return current_revisions() == script_heads(alembic)
+
+
+def upgrade(alembic: Alembic) -> None:
+    """Upgrade the database schema to the head revisions, unless it is
+    already."""
+    if at_head(alembic):
+        return
+    with named_lock(LOCK_NAME):
+        # Another process may have migrated while waiting for the lock.
+        if not at_head(alembic):
+            alembic.upgrade()
@@ -2,24 +2,60 @@
 """
 OIDC implementation.
 """
-import _thread
 import asyncio
+import atexit
+import hashlib
 import logging
+import os
+import random
+import re
 import sys
+import threading
 import time
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+from typing import Awaitable, Callable, Iterable, TypeVar
 from urllib.parse import urlparse, parse_qs, urlencode
 
 import aiohttp
-from flask import Flask, current_app, g
+from flask import Flask
 from jose import JWTError
 from jose import jwt, jwk
 from jose.exceptions import JWTClaimsError, ExpiredSignatureError, JWKError
 
+from .aio import background
+from .breaker import CircuitBreaker, CircuitOpenError
+from .metadata import MetadataCache
+from .metrics import metrics
+from .runtime import private_directory
+
 Redeemed = namedtuple('Redeemed', ['id_token', 'expires_in',
                                    'refresh_token', 'refresh_token_expires_in',
                                    'claims', 'profile']
                       )
+Cached = namedtuple('Cached', ['body', 'etag', 'last_modified', 'expires'])
+
+T = TypeVar("T")
+
+
+def unavailable(e: BaseException) -> bool:
+    """Return whether the error is a failure of the OIDC provider or the
+    connection to it, rather than an error response, e.g. to an invalid
+    grant."""
+    if isinstance(e, aiohttp.ClientResponseError):
+        return e.status >= 500
+    return isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError, OSError))
+
+
+def _error_name(e: BaseException) -> str:
+    if isinstance(e, aiohttp.ClientResponseError):
+        return str(e.status)
+    if isinstance(e, asyncio.TimeoutError):
+        return "timeout"
+    return "connection"
+
+
+class UnknownKeyError(JWKError):
+    """The token is signed by a key not published by the OIDC provider."""
 
 
 class OIDC:
@@ -28,21 +64,183 @@ class OIDC:
     This implementation is bound to flask and a running flask app.
     """
     _refresh = False
+    _refresher_pid: int | None = None
 
-    keys = []
+    keys: dict[tuple[str, str | None], jwk.Key] = {}
     config = {}
 
+    #: Maximum count of cached validated tokens.
+    token_cache_size: int = 256
+    #: Seconds the userinfo of a subject is reused when refreshing, and
+    #: the maximum count of cached userinfo.
+    userinfo_ttl: float = 60
+    userinfo_cache_size: int = 1024
+    #: Whether claims are taken from the userinfo, too.
+    claims_from_profile: bool = False
+
+    #: Bounds in seconds of the refresh interval of the metadata. Within
+    #: the bounds, the caching headers of the OIDC provider are honored.
+    min_refresh_interval: float = 60
+    refresh_interval: float = 3600
+    #: Minimum seconds between refreshes of the keys for unknown key ids.
+    rotation_interval: float = 30
+
     configuration_url: str
     client_id: str
     client_secret: str
 
+    pool_size: int = 100
+    keepalive_timeout: float = 60
+    dns_cache_ttl: int = 300
+    timeout = aiohttp.ClientTimeout(total=30, connect=5, sock_read=10)
+    #: Retries of idempotent requests, and the initial seconds between them.
+    retries: int = 2
+    retry_backoff: float = 0.5
+
+    #: Shared cache of the metadata, if any.
+    cache: MetadataCache | None = None
+    #: Whether the keys are fetched from the OIDC provider, instead of being
+    #: set manually.
+    fetch_keys: bool = True
+
+    _session: aiohttp.ClientSession | None = None
+
+    def __init__(self):
+        self._stats = {"requests": 0, "connections": 0, "reused": 0}
+        self._tokens: OrderedDict[bytes, dict] = OrderedDict()
+        self._tokens_lock = threading.Lock()
+        self._profiles: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._profiles_lock = threading.Lock()
+        self._metadata: dict[str, Cached] = {}
+        self._rotation: asyncio.Future | None = None
+        self._rotated_at = float("-inf")
+        self._refresher_lock = threading.Lock()
+        self.breaker = CircuitBreaker()
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Return the connection pool to the OIDC provider.
+
+        The session is bound to the background loop, and must only be used
+        there.
+        """
+        if self._session is None or self._session.closed:
+            trace = aiohttp.TraceConfig()
+            trace.on_request_start.append(self._count("requests"))
+            trace.on_connection_create_end.append(self._count("connections"))
+            trace.on_connection_reuseconn.append(self._count("reused"))
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.pool_size,
+                    keepalive_timeout=self.keepalive_timeout,
+                    ttl_dns_cache=self.dns_cache_ttl,
+                ),
+                timeout=self.timeout,
+                trace_configs=[trace],
+                raise_for_status=True,
+            )
+        return self._session
+
+    def _count(self, stat: str):
+        async def count(*_):
+            self._stats[stat] += 1
+        return count
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """Return statistics of the connection pool.
+
+        These are the count of requests, of created and of reused
+        connections, and the count of open connections in use and idle.
+        The latter are read from internals of the aiohttp connector, and
+        are missing if they changed.
+        """
+        stats = dict(self._stats)
+        if (session := self._session) is not None and not session.closed:
+            connector = session.connector
+            if isinstance(acquired := getattr(connector, "_acquired", None),
+                          set):
+                stats["active"] = len(acquired)
+            if isinstance(conns := getattr(connector, "_conns", None), dict):
+                stats["idle"] = sum(len(idle) for idle in conns.values())
+        return stats
+
+    async def _request(self, method: str, url: str,
+                       read: Callable[[aiohttp.ClientResponse], Awaitable[T]],
+                       **kwargs) -> T:
+        """Send a request through the circuit breaker and return the
+        response read by read. Idempotent requests are retried on failures
+        of the OIDC provider with jittered exponential backoff, within the
+        total timeout. Must run on the background loop."""
+        attempts = 1 + (self.retries if method in ("GET", "HEAD") else 0)
+        deadline = time.monotonic() + (self.timeout.total or float("inf"))
+        endpoint = self._endpoint_name(url)
+        for attempt in range(attempts):
+            try:
+                self.breaker.before_request()
+            except CircuitOpenError:
+                metrics.idp_rejected(endpoint)
+                raise
+            timeout = self.timeout
+            if timeout.total:
+                # Retries share the total timeout.
+                timeout = aiohttp.ClientTimeout(
+                    total=deadline - time.monotonic(), connect=timeout.connect,
+                    sock_read=timeout.sock_read,
+                    sock_connect=timeout.sock_connect,
+                )
+            start = time.perf_counter()
+            try:
+                async with self.session.request(method, url, timeout=timeout,
+                                                **kwargs) as resp:
+                    result = await read(resp)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                metrics.idp_request(endpoint, time.perf_counter() - start,
+                                    _error_name(e))
+                if not unavailable(e):
+                    # The OIDC provider answered.
+                    self.breaker.success()
+                    raise
+                self.breaker.failure()
+                delay = (self.retry_backoff * 2 ** attempt *
+                         random.uniform(0.5, 1.5))
+                if (attempt + 1 == attempts or
+                        time.monotonic() + delay >= deadline):
+                    raise
+                await asyncio.sleep(delay)
+            else:
+                metrics.idp_request(endpoint, time.perf_counter() - start)
+                self.breaker.success()
+                return result
+
+    def _endpoint_name(self, url: str) -> str:
+        """Return the name of an endpoint of the OIDC provider, for
+        metrics."""
+        if url == self.configuration_url:
+            return "configuration"
+        for name in ("jwks_uri", "token_endpoint", "userinfo_endpoint"):
+            if url == self.config.get(name):
+                return name.split("_")[0]
+        return "other"
+
+    async def _fetch(self, method: str, url: str, **kwargs) -> dict:
+        async def read(resp):
+            return await resp.json()
+        return await background.call(
+            self._request(method, url, read, **kwargs)
+        )
+
     @property
-    def session(self):
-        """Return a session for the current request."""
-        if 'aiohttp_session' not in g:
-            g.aiohttp_session = aiohttp.ClientSession()
+    def available(self) -> bool:
+        """Return whether requests are sent to the OIDC provider, i.e. the
+        circuit breaker is closed."""
+        return not self.breaker.open
 
-        return g.aiohttp_session
+    async def close(self) -> None:
+        """Close the connections to the OIDC provider."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
 
     @property
     def refresh(self):
@@ -52,9 +250,24 @@ class OIDC:
     @refresh.setter
     def refresh(self, new_bool):
         if not self._refresh and new_bool:
-            _thread.start_new_thread(self._refresh_config, (), {})
-
+            # The refresher of a previous activation may still be running.
+            self._refresher_pid = None
         self._refresh = new_bool
+        self.start_refresher()
+
+    def start_refresher(self) -> None:
+        """Start the background refresh in the current process, if enabled.
+
+        Forked workers, e.g. of gunicorn with preloading enabled, do not
+        inherit the refresher of the parent, so it is started once per
+        process on first use, like the background loop.
+        """
+        if not self._refresh or self._refresher_pid == os.getpid():
+            return
+        with self._refresher_lock:
+            if self._refresher_pid != os.getpid():
+                self._refresher_pid = os.getpid()
+                background.submit(self._refresher())
 
     @property
     def supports_frontchannel_logout(self):
@@ -62,32 +275,165 @@ class OIDC:
         return self.config.get("http_logout_supported") or \
             self.config.get("frontchannel_logout_supported")
 
+    async def _fetch_metadata(self, url: str) -> tuple[dict, bool]:
+        """Fetch a metadata document, revalidating a previously fetched
+        copy. Return the document and whether it changed."""
+        headers = {}
+        if cached := self._metadata.get(url):
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+
+        async def read(resp):
+            if resp.status == 304 and cached:
+                return resp.headers, None
+            return resp.headers, await resp.json()
+        response_headers, body = await background.call(
+            self._request("GET", url, read, headers=headers)
+        )
+
+        if body is None:
+            # Not modified, the validators may be omitted.
+            body = cached.body
+            etag = response_headers.get("ETag", cached.etag)
+            last_modified = response_headers.get("Last-Modified",
+                                                 cached.last_modified)
+        else:
+            etag = response_headers.get("ETag")
+            last_modified = response_headers.get("Last-Modified")
+        changed = cached is None or body is not cached.body
+        self._metadata[url] = Cached(
+            body,
+            etag,
+            last_modified,
+            time.time() + self._max_age(response_headers),
+        )
+        return body, changed
+
+    def _max_age(self, headers) -> float:
+        """Return the seconds a response may be used, within the bounds of
+        the refresh interval."""
+        cache_control = headers.get("Cache-Control", "")
+        if re.search(r"\bno-(cache|store)\b", cache_control):
+            max_age = 0
+        elif match := re.search(r"\bmax-age=(\d+)", cache_control):
+            max_age = int(match[1])
+        else:
+            max_age = self.refresh_interval
+        return min(max(max_age, self.min_refresh_interval),
+                   self.refresh_interval)
+
+    def _referenced(self, config: dict) -> set[str]:
+        """Return the URLs of the metadata documents used with the
+        configuration."""
+        urls = {self.configuration_url}
+        if self.fetch_keys and config.get("jwks_uri"):
+            urls.add(config["jwks_uri"])
+        return urls
+
+    def _prune(self, config: dict) -> None:
+        """Forget metadata documents the configuration no longer uses, so
+        that they are neither refreshed nor expire."""
+        for url in self._metadata.keys() - self._referenced(config):
+            del self._metadata[url]
+
     async def refresh_config(self) -> dict:
         """Refresh the configuration from the OIDC provider."""
-        async with aiohttp.request('GET', self.configuration_url) as response:
-            response.raise_for_status()
-            config = await response.json()
-            self.config = config
-            return config
+        config, _ = await self._fetch_metadata(self.configuration_url)
+        self.config = config
+        self._prune(config)
+        return config
 
     async def refresh_keys(self):
         """Refresh the configuration from the OIDC provider.
 
         :raise ExceptionGroup of JWK errors, or a value error.
         """
-        async with aiohttp.request('get', self.config["jwks_uri"]) as response:
-            response.raise_for_status()
-            self.set_keys(await response.json())
+        if not self.fetch_keys:
+            return
+        keys, changed = await self._fetch_metadata(self.config["jwks_uri"])
+        if changed:
+            self.set_keys(keys)
+
+    def _adopt(self, documents: dict[str, dict]) -> bool:
+        """Use the metadata documents of the shared cache. Return whether
+        the configuration and keys were found."""
+        if not (config := documents.get(self.configuration_url)):
+            return False
+        if self.fetch_keys:
+            if not (keys := documents.get(config["body"].get("jwks_uri"))):
+                return False
+            current = self._metadata.get(config["body"]["jwks_uri"])
+            if current is None or current.body != keys["body"]:
+                self.set_keys(keys["body"])
+
+        self._metadata.update(
+            (url, Cached(**documents[url]))
+            for url in self._referenced(config["body"]) if url in documents
+        )
+        self.config = config["body"]
+        self._prune(self.config)
+        return True
+
+    def load_cache(self) -> bool:
+        """Use the metadata of the shared cache, even if expired. Return
+        whether it was found."""
+        return self.cache is not None and self._adopt(self.cache.load())
+
+    async def refresh_metadata(self):
+        """Refresh the configuration and keys from the OIDC provider.
+
+        With a shared cache, only one worker fetches the metadata at a time,
+        the others wait and use the metadata it fetched if it did not
+        expire meanwhile.
+        """
+        if self.cache is None:
+            await self.refresh_config()
+            await self.refresh_keys()
+            return
+
+        async with self.cache.lock():
+            now = time.time()
+            if not (self._adopt(self.cache.load()) and all(
+                    cached.expires > now
+                    for cached in self._metadata.values())):
+                await self.refresh_config()
+                await self.refresh_keys()
+                self.cache.save({
+                    url: cached._asdict()
+                    for url, cached in self._metadata.items()
+                })
+
+    async def _rotate_keys(self) -> bool:
+        """Refresh the keys for an unknown key id, at most once per rotation
+        interval. Concurrent calls share a refresh. Must run on the
+        background loop. Return whether the keys were refreshed."""
+        if self._rotation is None:
+            if time.monotonic() - self._rotated_at < self.rotation_interval:
+                return False
+            self._rotated_at = time.monotonic()
+            self._rotation = asyncio.ensure_future(self.refresh_keys())
+            self._rotation.add_done_callback(
+                lambda _: setattr(self, "_rotation", None)
+            )
+        try:
+            await asyncio.shield(self._rotation)
+        except Exception:
+            logging.getLogger(__name__).error("Cannot refresh keys.",
+                                              exc_info=sys.exc_info())
+            return False
+        return True
 
     def set_keys(self, obj):
         """Update the keys of the OIDC provider"""
-        keys = []
+        keys = {}
         exceptions = []
         certs = obj["keys"]
         # There can be unusable keys here
         verifying = filter(
             lambda k:
-            k["alg"] != "RSA-OAEP" and
+            k.get("alg") != "RSA-OAEP" and
             k.get("use", "sig") == "sig" and
             "verify" in k.get("key_ops", ["verify"]),
             certs
@@ -98,89 +444,155 @@ class OIDC:
             except JWKError as e:
                 exceptions.append(e)
             else:
-                keys.append((cert.get("kid", ""), key))
+                keys[cert.get("kid", ""), cert.get("alg")] = key
         if not keys and exceptions:
             raise ExceptionGroup("Cannot decode any jwk!", exceptions)
         if not keys:
             raise ValueError("No keys found!")
         self.keys = keys
+        # Tokens signed by removed keys must be validated again.
+        with self._tokens_lock:
+            self._tokens.clear()
         return keys
 
-    def _refresh_config(self):
+    def _candidate_keys(self, header: dict) -> list[tuple[str, jwk.Key]]:
+        """Return the keys that may have signed a token with the header."""
+        kid = header.get("kid")
+        alg = header.get("alg")
+        return [
+            (key_kid, key) for (key_kid, key_alg), key in self.keys.items()
+            if (kid is None or key_kid == kid) and key_alg in (None, alg)
+        ]
+
+    async def _refresher(self):
+        """Refresh the metadata when it expires, retry with jittered
+        exponential backoff on failure."""
+        failures = 0
         while self._refresh:
-            time.sleep(3600)
+            if failures:
+                delay = min(self.refresh_interval, 5 * 2 ** failures)
+                delay *= random.uniform(0.5, 1.5)
+            else:
+                delay = min((cached.expires for cached in
+                             self._metadata.values()),
+                            default=time.time() + self.refresh_interval)
+                delay -= time.time()
+            await asyncio.sleep(max(delay, 0))
 
             try:
-                _ = asyncio.run(self.refresh_config())
-            except:  # noqa: E722
-                logging.getLogger(__name__).error("Cannot refresh config.",
+                await self.refresh_metadata()
+            except Exception:
+                failures += 1
+                logging.getLogger(__name__).error("Cannot refresh metadata.",
                                                   exc_info=sys.exc_info())
+            else:
+                failures = 0
 
-            try:
-                _ = asyncio.run(self.refresh_keys())
-            except:  # noqa: E722
-                logging.getLogger(__name__).error("Cannot refresh keys.",
-                                                  exc_info=sys.exc_info())
+    async def _redeem(self, token_data, required: Iterable[str] = (),
+                      cached: bool = False) \
+            -> tuple[Redeemed, Exception | None]:
+        """Redeem a grant at the token endpoint.
 
-    async def _redeem(self, token_data) -> tuple[Redeemed, Exception | None]:
+        The userinfo is fetched if claims in required are missing from the
+        ID token, or if claims are taken from the profile. When refreshing,
+        the userinfo of the last OIDC_USERINFO_CACHE_TTL seconds is reused.
+        """
         auth = None
         if not self.client_secret:
             token_data["client_id"] = self.client_id
         elif "client_secret_post" not in \
                 self.config.get("token_endpoint_auth_methods_supported", ()):
             token_data["client_id"] = self.client_id
-            auth = (self.client_id, self.client_secret)
+            auth = aiohttp.BasicAuth(self.client_id, self.client_secret)
         else:
             token_data["client_id"] = self.client_id
             token_data["client_secret"] = self.client_secret
 
-        token_response = await self.session.post(self.config["token_endpoint"],
-                                                 data=token_data, auth=auth)
         try:
-            token_response.raise_for_status()
-        except IOError as e:
+            token_json = await self._fetch("POST",
+                                           self.config["token_endpoint"],
+                                           data=token_data, auth=auth)
+        except (IOError, aiohttp.ClientError) as e:
             return Redeemed(None, 0, None, 0, {}, {}), e
-        token_json = await token_response.json()
 
-        claims, e = self.validate_token(
-            token_json["id_token"],
-            token_json.get("access_token")
-        )
+        id_token = token_json["id_token"]
+        at = token_json.get("access_token")
+        try:
+            unverified = jwt.get_unverified_claims(id_token)
+        except JWTError:
+            unverified = {}
 
-        if e is not None:
+        # The userinfo is only needed for claims missing in the ID token,
+        # and then fetched while validating the ID token.
+        profile = {}
+        try:
+            if at and (self.claims_from_profile or
+                       any(not unverified.get(claim) for claim in required)):
+                (claims, e), profile = await asyncio.gather(
+                    self.validate(id_token, at),
+                    self._userinfo(at, unverified.get("sub"), cached)
+                )
+            else:
+                claims, e = await self.validate(id_token, at)
+        except (IOError, aiohttp.ClientError) as e:
             return Redeemed(None, 0, None, 0, {}, {}), e
 
-        profile = {}
-        if at := token_json.get("access_token"):
-            profile = await (await self.session.get(
-                self.config["userinfo_endpoint"],
-                headers={"Authorization": f"Bearer {at}"}
-            )).json()
+        if e is not None:
+            return Redeemed(None, 0, None, 0, {}, {}), e
+        if profile and profile.get("sub") != claims["sub"]:
+            return Redeemed(None, 0, None, 0, {}, {}), JWTClaimsError(
+                "The subject of the userinfo does not match."
+            )
 
         return Redeemed(
-            token_json["id_token"],
+            id_token,
             token_json.get("expires_in", 0),
             token_json.get("refresh_token"),
             token_json.get("refresh_expires_in"),
             claims, profile
         ), None
 
-    async def redeem_refresh(self, code) -> tuple[Redeemed, Exception | None]:
+    async def _userinfo(self, access_token: str, sub: str | None,
+                        cached: bool) -> dict:
+        """Return the userinfo, or the cached userinfo of the subject."""
+        if cached and sub is not None:
+            with self._profiles_lock:
+                entry = self._profiles.get(sub)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1]
+
+        profile = await self._fetch(
+            "GET", self.config["userinfo_endpoint"],
+            headers={"Authorization": f"Bearer {access_token}"}
+        )
+        if (self.userinfo_ttl > 0 and sub is not None and
+                profile.get("sub") == sub):
+            with self._profiles_lock:
+                self._profiles[sub] = (time.monotonic() + self.userinfo_ttl,
+                                       profile)
+                self._profiles.move_to_end(sub)
+                if len(self._profiles) > self.userinfo_cache_size:
+                    self._profiles.popitem(last=False)
+        return profile
+
+    async def redeem_refresh(self, code, required: Iterable[str] = ()) \
+            -> tuple[Redeemed, Exception | None]:
         """Redeem a refresh token to claims and userinfo."""
         return await self._redeem({
             "grant_type": "refresh_token",
             "refresh_token": code,
             "scope": "openid email profile",
-        })
+        }, required, cached=True)
 
-    async def redeem_code(self, code, redirect_uri) -> \
+    async def redeem_code(self, code, redirect_uri,
+                          required: Iterable[str] = ()) -> \
             tuple[Redeemed, Exception | None]:
         """Redeem an access token to claims and userinfo."""
         return await self._redeem({
             "grant_type": "authorization_code",
             "code": code,
             "redirect_uri": redirect_uri
-        })
+        }, required)
 
     def get_login_uri(self, state, redirect_uri) -> str:
         """Return the redirect URL to sign in."""
@@ -217,28 +629,70 @@ class OIDC:
         query["post_logout_redirect_uri"] = post_logout
         return endpoint_url._replace(query=urlencode(query)).geturl()
 
+    async def validate(self, token: str, at: str | None = None, typ="ID") \
+            -> tuple[dict | None, Exception | None]:
+        """Validate an open id connect token, refreshing the keys if it is
+        signed by an unknown key."""
+        claims, e = self.validate_token(token, at, typ)
+        if (isinstance(e, UnknownKeyError)
+                and await background.call(self._rotate_keys())):
+            claims, e = self.validate_token(token, at, typ)
+        return claims, e
+
     def validate_token(self, token: str, at: str | None = None, typ="ID") -> \
             tuple[dict | None, Exception | None]:
-        """Validate an open id connect token."""
-        exceptions = []
-        for (kid, key) in self.keys:
+        """Validate an open id connect token.
+
+        Only the keys matching the key id and algorithm of the token header
+        are tried. Validated tokens are cached until they expire.
+        """
+        digest = hashlib.sha256(
+            f"{token}\0{at or ''}".encode()
+        ).digest()
+        with self._tokens_lock:
+            if (claims := self._tokens.get(digest)) is not None:
+                self._tokens.move_to_end(digest)
+        if claims is not None and claims.get("exp", 0) <= time.time():
+            with self._tokens_lock:
+                self._tokens.pop(digest, None)
+            claims = None
+
+        if claims is None:
             try:
-                claims = jwt.decode(
-                    token,
-                    key,
-                    audience=self.client_id,
-                    access_token=at,
-                    issuer=self.config["issuer"]
+                header = jwt.get_unverified_header(token)
+            except JWTError as e:
+                return None, e
+            if not (keys := self._candidate_keys(header)):
+                return None, UnknownKeyError(
+                    f"Unknown key {header.get('kid')} ({header.get('alg')})"
                 )
-                break
-            except (JWTError, JWTClaimsError, ExpiredSignatureError) as e:
-                exceptions.append(e)
-        else:
-            return None, ExceptionGroup("Cannot decode token", exceptions)
 
-        logging.getLogger(__name__).info("Got %s token for %s signed by %s" % (
-            claims.get("typ", "ID"), claims.get("sub", "-"), kid,
-        ))
+            exceptions = []
+            for (kid, key) in keys:
+                try:
+                    claims = jwt.decode(
+                        token,
+                        key,
+                        audience=self.client_id,
+                        access_token=at,
+                        issuer=self.config["issuer"]
+                    )
+                    break
+                except (JWTError, JWTClaimsError, ExpiredSignatureError) as e:
+                    exceptions.append(e)
+            else:
+                return None, ExceptionGroup("Cannot decode token", exceptions)
+
+            logging.getLogger(__name__).info(
+                "Got %s token for %s signed by %s" % (
+                    claims.get("typ", "ID"), claims.get("sub", "-"), kid,
+                )
+            )
+            if "exp" in claims:
+                with self._tokens_lock:
+                    self._tokens[digest] = claims
+                    while len(self._tokens) > self.token_cache_size:
+                        self._tokens.popitem(last=False)
 
         if not claims.get("typ", "ID") == typ:
             return None, ValueError("Invalid type: %s" % claims["typ"])
@@ -249,14 +703,37 @@ class OIDC:
         self.configuration_url = app.config["OIDC_DISCOVERY_URL"]
         self.client_id = app.config["OIDC_CLIENT_ID"]
         self.client_secret = app.config["OIDC_CLIENT_SECRET"]
+        self.fetch_keys = not app.config.get("OIDC_CERTS")
+        self.claims_from_profile = bool(
+            app.config.get("OIDC_CLAIMS_FROM_PROFILE")
+        )
+        self.userinfo_ttl = float(app.config["OIDC_USERINFO_CACHE_TTL"])
+        digest = hashlib.sha256(self.configuration_url.encode()).hexdigest()
+        self.cache = MetadataCache(
+            app.config.get("OIDC_CACHE_FILE") or os.path.join(
+                app.config["RUNTIME_DIR"], "oidc-%s.json" % digest[:16]
+            )
+        )
+        # Fail on startup if other users could inject signing keys.
+        private_directory(os.path.dirname(self.cache.path) or ".")
+
+        self.pool_size = int(app.config["OIDC_HTTP_POOL_SIZE"])
+        self.timeout = aiohttp.ClientTimeout(
+            total=float(app.config["OIDC_HTTP_TIMEOUT"]),
+            connect=float(app.config["OIDC_HTTP_CONNECT_TIMEOUT"]),
+            sock_read=float(app.config["OIDC_HTTP_READ_TIMEOUT"]),
+        )
+        self.retries = int(app.config["OIDC_HTTP_RETRIES"])
+        self.breaker = CircuitBreaker(
+            int(app.config["OIDC_BREAKER_THRESHOLD"]),
+            float(app.config["OIDC_BREAKER_RESET"]),
+        )
+        atexit.register(self._close_at_exit)
+        app.before_request(self.start_refresher)
 
-        app.teardown_request(self._teardown)
-
-    async def _teardown(self, request):
-        if session := g.pop("aiohttp_session", None):
-            await session.close()
-
-
+    def _close_at_exit(self):
+        if self._session is not None:
+            background.run(self.close())
 
 
 oidc = OIDC()
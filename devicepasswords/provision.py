@@ -0,0 +1,146 @@
+# SPDX-License-Identifier: MPL-2.0
+"""
+Bulk provisioning of device passwords.
+
+Records of users and token names are read as a stream and processed in
+batches: users are upserted, passwords are generated and hashed on all
+workers of the hash pool, and the tokens of a batch are inserted in a
+single transaction. Only one batch is held in memory at a time.
+"""
+import csv
+import itertools
+import json
+from typing import IO, Iterable, Iterator
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from .db import db, Token, TokenHash, User
+from .devpwd import device_passwords
+from .expiration import parse_expiration
+from .hashpool import hash_pool
+from .logins import allocate_logins_sync, logins_taken
+
+FIELDS = ("sub", "username", "email", "name", "expires")
+
+
+def read_records(stream: IO[str], fmt: str) -> Iterator[dict]:
+    """Read records from a CSV file with a header line or from newline
+    delimited JSON objects. Raise ValueError naming the record for invalid
+    records."""
+    if fmt == "csv":
+        records = csv.DictReader(stream)
+    else:
+        records = (line for line in stream if line.strip())
+
+    for number, record in enumerate(records, start=1):
+        try:
+            if isinstance(record, str):
+                record = json.loads(record)
+            if not isinstance(record, dict):
+                raise ValueError("not an object")
+            if missing := [field for field in FIELDS[:4]
+                           if not record.get(field)]:
+                raise ValueError(f"missing {', '.join(missing)}")
+            if invalid := [field for field in FIELDS[:4]
+                           if not isinstance(record[field], str)]:
+                raise ValueError(f"{', '.join(invalid)} must be strings")
+            expires = parse_expiration(record.get("expires"))
+        except ValueError as e:
+            raise ValueError(f"Record {number}: {e}") from None
+        yield {
+            **{field: record[field] for field in FIELDS[:4]},
+            "expires": expires,
+        }
+
+
+def write_records(stream: IO[str], fmt: str,
+                  records: Iterable[dict]) -> None:
+    """Write provisioned records as CSV with a header line or as newline
+    delimited JSON objects, flushing each batch."""
+    writer = None
+    if fmt == "csv":
+        writer = csv.DictWriter(stream, ("sub", "username", "email", "name",
+                                         "expires", "login", "secret"))
+        writer.writeheader()
+
+    for record in records:
+        record = {**record, "expires": record["expires"] and
+                  record["expires"].isoformat()}
+        if writer is not None:
+            writer.writerow(record)
+        else:
+            stream.write(json.dumps(record) + "\n")
+        stream.flush()
+
+
+def _upsert_users(records: list[dict]) -> None:
+    users = {record["sub"]: record for record in records}
+    # Load existing users at once, so merging does not query each.
+    db.session.execute(
+        db.select(User).filter(User.sub.in_(users))
+    ).scalars().all()
+    for sub, record in users.items():
+        db.session.merge(User(sub=sub, username=record["username"],
+                              email=record["email"]))
+
+
+def _insert_tokens(records: list[dict], hashes: list[str],
+                   scheme_hashes: dict[str, list[str]]) -> list[str]:
+    logins = allocate_logins_sync(db.session,
+                                  [record["username"] for record in records])
+    if None in logins:
+        raise ValueError("Cannot create unique identifier for "
+                         f"{records[logins.index(None)]['username']}")
+    db.session.add_all(
+        Token(sub=record["sub"], name=record["name"], token=hashes[i],
+              expires=record["expires"], login=login, hashes=[
+                  TokenHash(scheme=scheme, hash=scheme_hashes[scheme][i])
+                  for scheme in scheme_hashes
+              ])
+        for i, (record, login) in enumerate(zip(records, logins))
+    )
+    return logins
+
+
+def provision(records: Iterable[dict], batch_size: int = 100,
+              wordlist: str | None = None) -> Iterator[dict]:
+    """Create a device password for each record and yield the records with
+    the login and the secret.
+
+    Each batch is committed before its records are yielded. Must be called
+    within an app context.
+    """
+    scheme = current_app.config["PASSWORD_HASH"]
+    schemes = current_app.config["PASSWORD_HASHES"]
+    records = iter(records)
+    while batch := list(itertools.islice(records, batch_size)):
+        secrets = device_passwords.generate_many(len(batch), wordlist)
+        # All hashes are submitted to the pool before any is awaited.
+        hashes = hash_pool.hash_many(secrets, scheme)
+        scheme_hashes = {other: hash_pool.hash_many(secrets, other)
+                         for other in schemes}
+        hashes = list(hashes)
+        scheme_hashes = {other: list(values)
+                         for other, values in scheme_hashes.items()}
+
+        # Retry if a login was taken concurrently.
+        for attempt in range(3):
+            logins = None
+            try:
+                _upsert_users(batch)
+                logins = _insert_tokens(batch, hashes, scheme_hashes)
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+                if (attempt == 2 or logins is None or
+                        not logins_taken(db.session, logins)):
+                    raise
+            except:  # noqa: E722
+                db.session.rollback()
+                raise
+            else:
+                break
+
+        for record, login, secret in zip(batch, logins, secrets):
+            yield {**record, "login": login, "secret": secret}
@@ -2,12 +2,13 @@
 """
 Password hasher.
 """
+from typing import Iterable
+
 from devicepasswords import hashes as _
 
 from passlib.context import CryptContext
 
-
-hasher = CryptContext([
+SCHEMES = [
     "plaintext",
     "hex_md5", "hex_sha1", "hex_sha256", "hex_sha512",
     "ldap_md5", "ldap_sha1", "ldap_salted_md5", "ldap_salted_sha1",
@@ -19,4 +20,25 @@ hasher = CryptContext([
     "md5_crypt", "sha1_crypt", "sha256_crypt", "sha512_crypt",
     # Custom implementations
     "dovecot_scram_sha1", "dovecot_scram_sha256"
-])
+]
+
+hasher = CryptContext(SCHEMES)
+
+
+def configure(settings: dict) -> None:
+    """Replace the settings of the hasher with CryptContext settings, e.g.
+    ``{"bcrypt__default_rounds": 13}``."""
+    hasher.load({**settings, "schemes": SCHEMES})
+
+
+def identify(hash: str, preferred: Iterable[str] = ()) -> str:
+    """Return the scheme of a hash, trying the preferred schemes first.
+
+    Several schemes may match a hash, e.g. hex_md5 and nthash, and
+    plaintext matches any value, so it is only assumed if no other scheme
+    matches.
+    """
+    for scheme in dict.fromkeys([*preferred, *SCHEMES]):
+        if scheme != "plaintext" and hasher.handler(scheme).identify(hash):
+            return scheme
+    return "plaintext"
@@ -0,0 +1,121 @@
+# SPDX-License-Identifier: MPL-2.0
+"""
+Retention of revoked and server-side sessions.
+
+Expired rows are deleted in small batches, so that the tables are not
+locked for long periods.
+"""
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import sqlalchemy as sa
+from flask import Flask, current_app
+
+from .db import db, Revoked, Version
+from .revocation import VERSION
+
+
+def _delete_expired(table, key, expiry, now: datetime,
+                    batch_size: int, on_delete=None) -> int:
+    """Delete expired rows of a table in batches, return the count."""
+    deleted = 0
+    while keys := db.session.execute(
+            sa.select(key).where(expiry < now).limit(batch_size)
+    ).scalars().all():
+        db.session.execute(sa.delete(table).where(key.in_(keys)))
+        if on_delete is not None:
+            on_delete()
+        db.session.commit()
+        deleted += len(keys)
+    return deleted
+
+
+def _revoked_changed() -> None:
+    # Let workers reload their smaller revocation cache.
+    db.session.execute(
+        db.update(Version)
+        .filter_by(name=VERSION)
+        .values(value=Version.value + 1)
+    )
+
+
+def sweep(batch_size: int = 500) -> dict[str, int]:
+    """Delete expired revocations and sessions.
+
+    Return the count of deleted rows per table.
+    """
+    deleted = {
+        Revoked.__tablename__: _delete_expired(
+            Revoked.__table__, Revoked.sid, Revoked.expires, datetime.now(),
+            batch_size, _revoked_changed
+        )
+    }
+
+    if current_app.config["SESSION_TYPE"] == "sqlalchemy":
+        sessions = sa.table(
+            current_app.config.get("SESSION_SQLALCHEMY_TABLE", "sessions"),
+            sa.column("id"), sa.column("expiry")
+        )
+        # Flask-Session stores the expiration in UTC.
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        deleted[sessions.name] = _delete_expired(
+            sessions, sessions.c.id, sessions.c.expiry, now, batch_size
+        )
+
+    return deleted
+
+
+class Sweeper:
+    """Periodically delete expired rows in the background."""
+    interval: float = 0
+    batch_size: int = 500
+
+    _app: Flask | None = None
+    _pid: int | None = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """Start the sweeps in the current process, if enabled.
+
+        Forked workers, e.g. of gunicorn with preloading enabled, do not
+        inherit the thread of the parent, so it is started once per process,
+        and again before requests of a forked worker.
+        """
+        if self.interval <= 0 or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name="sweeper",
+                                 daemon=True).start()
+
+    def _run(self) -> None:
+        logger = logging.getLogger(__name__)
+        # Spread the sweeps of multiple workers.
+        time.sleep(random.uniform(0, self.interval))
+        while True:
+            try:
+                with self._app.app_context():
+                    deleted = sweep(self.batch_size)
+                logger.info("Deleted expired rows: %s", deleted)
+            except:  # noqa: E722
+                logger.error("Cannot delete expired rows.",
+                             exc_info=sys.exc_info())
+            time.sleep(self.interval)
+
+    def init_app(self, app: Flask) -> None:
+        self.interval = float(app.config["SWEEP_INTERVAL"])
+        self.batch_size = int(app.config["SWEEP_BATCH_SIZE"])
+        self._app = app
+        self.start()
+        app.before_request(self.start)
+
+
+sweeper = Sweeper()
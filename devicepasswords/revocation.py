@@ -0,0 +1,106 @@
+# SPDX-License-Identifier: MPL-2.0
+"""
+Cache of revoked sessions.
+
+Each worker caches whether the session ids it looked up are revoked. The
+cached lookups are dropped if the "revoked" counter in the versions table
+changed, which is checked at most every REVOKED_CACHE_TTL seconds.
+Revocations by other workers or nodes are therefore visible after at most
+that time. Only the sessions used again are looked up again, the revoked
+table is never loaded as a whole.
+"""
+import time
+from datetime import datetime
+
+import sqlalchemy as sa
+from flask import Flask
+from sqlalchemy.orm import Session
+
+from .adb import adb
+from .db import Revoked, Version
+from .metrics import metrics
+
+VERSION = "revoked"
+
+
+def _load_version(session: Session) -> int | None:
+    return session.execute(
+        sa.select(Version.value).filter_by(name=VERSION)
+    ).scalar()
+
+
+def _is_revoked(session: Session, sid: str) -> bool:
+    return session.get(Revoked, sid) is not None
+
+
+def _revoke(session: Session, sid: str, expires: datetime) -> None:
+    session.merge(Revoked(sid=sid, expires=expires))
+    session.execute(
+        sa.update(Version)
+        .filter_by(name=VERSION)
+        .values(value=Version.value + 1)
+    )
+    session.commit()
+
+
+class RevocationCache:
+    """Per-worker cache of lookups of revoked session ids."""
+    ttl: float = 5
+
+    _version: int | None = None
+    _checked: float | None = None
+
+    def __init__(self):
+        self._known: dict[str, bool] = {}
+
+    def _expired(self) -> bool:
+        return (self._checked is None or
+                time.monotonic() - self._checked > self.ttl)
+
+    async def _synchronize(self) -> None:
+        """Drop the cached lookups if the revoked session ids changed."""
+        # Concurrent requests use the cached lookups meanwhile.
+        self._checked = time.monotonic()
+        try:
+            version = await adb.run(_load_version)
+        except:  # noqa: E722
+            self._checked = None
+            raise
+        if version is None or version != self._version:
+            self._known = {}
+        self._version = version
+
+    async def is_revoked(self, sid: str) -> bool:
+        """Check if a session was revoked."""
+        if self.ttl <= 0:
+            metrics.revocation_lookup(cached=False)
+            return await adb.run(_is_revoked, sid)
+
+        if self._expired():
+            await self._synchronize()
+        known = self._known
+        if sid in known:
+            metrics.revocation_lookup(cached=True)
+            return known[sid]
+        metrics.revocation_lookup(cached=False)
+        revoked = await adb.run(_is_revoked, sid)
+        # Not kept if the lookups were dropped meanwhile, it may be stale.
+        known[sid] = revoked
+        return revoked
+
+    async def revoke(self, sid: str, expires: datetime) -> None:
+        """Revoke a session and publish the revocation to all workers.
+
+        The revocation is kept until the session expires.
+        """
+        await adb.run(_revoke, sid, expires)
+        self._known[sid] = True
+
+    def init_app(self, app: Flask) -> None:
+        self.ttl = float(app.config["REVOKED_CACHE_TTL"])
+        # The lookups of another database, e.g. of a previous app in tests.
+        self._known = {}
+        self._version = self._checked = None
+
+
+revocations = RevocationCache()
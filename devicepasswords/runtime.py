@@ -0,0 +1,45 @@
+# SPDX-License-Identifier: MPL-2.0
+"""
+Private runtime files.
+
+The workers share files, e.g. the cached metadata of the OIDC provider, the
+compiled wordlists and lock files. Their content is trusted, so they are
+kept in directories only accessible by the user of the service, and files
+owned by other users or writable by them are refused.
+"""
+import os
+import stat
+
+
+def _check(path: str, st: os.stat_result) -> None:
+    if st.st_uid != os.geteuid():
+        raise PermissionError(f"{path} is not owned by the service user.")
+    if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise PermissionError(f"{path} is writable by other users.")
+
+
+def private_directory(path: str) -> str:
+    """Create the directory accessible by the service user only, or check
+    an existing one is not writable by other users. Return the path."""
+    try:
+        os.makedirs(path, mode=0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        raise NotADirectoryError(f"{path} is not a directory.")
+    _check(path, st)
+    return path
+
+
+def open_private(path: str, flags: int = os.O_RDONLY) -> int:
+    """Open a file of a private directory without following symlinks,
+    return its file descriptor. New files are only accessible by the
+    service user."""
+    fd = os.open(path, flags | os.O_NOFOLLOW | os.O_CLOEXEC, 0o600)
+    try:
+        _check(path, os.fstat(fd))
+    except OSError:
+        os.close(fd)
+        raise
+    return fd
@@ -0,0 +1,148 @@
+# SPDX-License-Identifier: MPL-2.0
+"""
+Server-side sessions with a read-through cache.
+
+Sessions are stored in the sessions table by Flask-Session, serialized
+with msgpack. Each worker caches the sessions it loaded or saved for
+SESSION_CACHE_TTL seconds, and the frequently polled API endpoints use the
+cached session instead of loading it again. Changes of a session by other
+workers, e.g. a new CSRF state, are therefore visible to those endpoints
+after at most that time.
+
+Only logged in sessions with a session id (sid) of the OIDC provider are
+cached. Logouts revoke the session id, and revoked session ids are checked
+separately, so a logout on another worker takes effect after at most
+REVOKED_CACHE_TTL seconds, regardless of the cache. Sessions due to be
+refreshed are always loaded, so that tokens refreshed by another worker are
+used.
+"""
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Optional
+
+from flask import Flask, Request
+from flask_session import Session
+from flask_session.defaults import Defaults
+from flask_session.sqlalchemy import SqlAlchemySessionInterface
+from flask_session.sqlalchemy.sqlalchemy import SqlAlchemySession
+from werkzeug.exceptions import HTTPException
+
+#: Endpoints reading cached sessions. They only modify sessions to refresh
+#: or destroy them, and sessions due to be refreshed are not cached.
+CACHED_ENDPOINTS = frozenset({"views.ping", "views.tokens"})
+#: Maximum number of sessions cached per worker.
+CACHE_SIZE = 4096
+
+_cacheable = contextvars.ContextVar("cacheable", default=False)
+
+
+class CachedSqlAlchemySessionInterface(SqlAlchemySessionInterface):
+    """SQLAlchemy session interface with a per-worker read-through cache."""
+
+    def __init__(self, app: Flask, *args, cache_ttl: float = 5,
+                 refresh_window: float = 30, **kwargs):
+        super().__init__(app, *args, **kwargs)
+        self.cache_ttl = float(cache_ttl)
+        self.refresh_window = float(refresh_window)
+        self._cache: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def _cached(self, app: Flask, request: Request) -> bool:
+        if self.cache_ttl <= 0 or request.method not in ("GET", "HEAD"):
+            return False
+        try:
+            endpoint, _ = app.create_url_adapter(request).match()
+        except HTTPException:
+            return False
+        return endpoint in CACHED_ENDPOINTS
+
+    def _fresh(self, data: dict) -> bool:
+        return data.get("exp", 0) - time.time() > self.refresh_window
+
+    def _remember(self, store_id: str, data: dict | None) -> None:
+        with self._cache_lock:
+            if not data or not data.get("sub") or not data.get("sid"):
+                # Logouts of sessions without session id are not revoked,
+                # so they must not be served from the cache.
+                self._cache.pop(store_id, None)
+                return
+            self._cache[store_id] = (time.monotonic() + self.cache_ttl,
+                                     dict(data))
+            self._cache.move_to_end(store_id)
+            if len(self._cache) > CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+    def open_session(self, app: Flask, request: Request) -> SqlAlchemySession:
+        token = _cacheable.set(self._cached(app, request))
+        try:
+            return super().open_session(app, request)
+        finally:
+            _cacheable.reset(token)
+
+    def _retrieve_session_data(self, store_id: str) -> Optional[dict]:
+        if _cacheable.get():
+            with self._cache_lock:
+                cached = self._cache.get(store_id)
+            if (cached is not None and cached[0] > time.monotonic() and
+                    self._fresh(cached[1])):
+                return dict(cached[1])
+
+        data = super()._retrieve_session_data(store_id)
+        if self.cache_ttl > 0:
+            self._remember(store_id, data)
+        return data
+
+    def _upsert_session(self, session_lifetime: timedelta,
+                        session: SqlAlchemySession, store_id: str) -> None:
+        super()._upsert_session(session_lifetime, session, store_id)
+        if self.cache_ttl > 0:
+            self._remember(store_id, session)
+
+    def _delete_session(self, store_id: str) -> None:
+        super()._delete_session(store_id)
+        self._remember(store_id, None)
+
+    def load(self, sid: str) -> dict | None:
+        """Return the stored data of a session, bypassing the cache. Needs
+        the app context."""
+        return self._retrieve_session_data(self._get_store_id(sid))
+
+    def store(self, sid: str, data: dict) -> None:
+        """Store the data of a session. Needs the app context."""
+        self._upsert_session(self.app.permanent_session_lifetime, data,
+                             self._get_store_id(sid))
+
+
+class CachedSession(Session):
+    """Flask-Session extension caching sessions stored with SQLAlchemy."""
+
+    def init_app(self, app: Flask) -> None:
+        config = app.config
+        if config.get("SESSION_TYPE", "").lower() != "sqlalchemy":
+            super().init_app(app)
+            return
+
+        def option(name: str):
+            name = f"SESSION_{name}"
+            return config.get(name, getattr(Defaults, name))
+
+        # The options of the SQLAlchemy backend of Flask-Session.
+        app.session_interface = CachedSqlAlchemySessionInterface(
+            app,
+            key_prefix=option("KEY_PREFIX"),
+            use_signer=option("USE_SIGNER"),
+            permanent=option("PERMANENT"),
+            sid_length=option("ID_LENGTH"),
+            serialization_format=option("SERIALIZATION_FORMAT"),
+            client=option("SQLALCHEMY"),
+            table=option("SQLALCHEMY_TABLE"),
+            sequence=option("SQLALCHEMY_SEQUENCE"),
+            schema=option("SQLALCHEMY_SCHEMA"),
+            bind_key=option("SQLALCHEMY_BIND_KEY"),
+            cleanup_n_requests=option("CLEANUP_N_REQUESTS"),
+            cache_ttl=config["SESSION_CACHE_TTL"],
+            refresh_window=config["SESSION_REFRESH_WINDOW"],
+        )
@@ -2,19 +2,37 @@
 """
 Session management.
 """
+import asyncio
+import hashlib
 import logging
 import secrets
 import time
 from datetime import datetime, timedelta
 
-from asgiref.sync import sync_to_async
-from flask import current_app, abort, session
+from flask import Flask, current_app, abort, session
+from werkzeug.exceptions import HTTPException
 
-from .db import db, Revoked
-from .oidc import Redeemed, OIDC
+from .aio import background
+from .locks import LockTimeoutError, PollingLock, named_lock
+from .oidc import Redeemed, OIDC, unavailable
+from .revocation import revocations
+from .sessions import CachedSqlAlchemySessionInterface
 
 logger = logging.getLogger(__name__)
 
+#: Maximum length of picture URLs stored in the session.
+MAX_PICTURE_LENGTH = 2048
+#: Number of locks shared by the refreshes of all sessions.
+REFRESH_LOCKS = 64
+#: Seconds to wait for the refresh of another worker.
+REFRESH_LOCK_TIMEOUT = 60
+
+#: Returned by refreshes postponed as the OIDC provider is unavailable.
+POSTPONED = object()
+
+#: Refreshes in progress by session id, on the background loop.
+_refreshes: dict[str, asyncio.Future] = {}
+
 
 async def valid_session(oidc: OIDC) -> bool:
     """Return if a session is valid, refresh if short to expire."""
@@ -27,56 +45,178 @@ async def valid_session(oidc: OIDC) -> bool:
 
     # Test if session was revoked by IdP
     if sid := session.get("sid"):
-        if (await sync_to_async(db.session.get)(Revoked, sid)) is not None:
+        if await revocations.is_revoked(sid):
             return False
 
-    if valid_for > 30:  # TODO: Make configurable
+    if valid_for > current_app.config["SESSION_REFRESH_WINDOW"]:
         return True
 
     if (not session.get("refresh_token") or (
-        session.get("refresh_token_expiration") is not None and
-        session.get("refresh_token_expiration") < datetime.now())):
+        refresh_token_expiration() is not None and
+        refresh_token_expiration() < datetime.now())):
         # Cannot refresh session, but is still valid.
         return True
 
+    if not oidc.available:
+        # The OIDC provider is failing, refresh after it recovered.
+        return True
+
     current_app.logger.info("Refreshing session (sid=%s)" % sid)
-    redeemed, e = await oidc.redeem_refresh(session.get("refresh_token"))
-    if e is not None:
-        current_app.logger.warning(
-            "Refreshing failed (sid=%s)" % sid,
-            exc_info=(type(e), e, e.__traceback__)
-        )
+    try:
+        refreshed = await background.call(_join_refresh(
+            current_app._get_current_object(), oidc, session.sid,
+            dict(session)
+        ))
+    except HTTPException:
+        # Required claims are missing.
+        session.clear()
+        raise
+    if refreshed is None:
         await destroy_session(sid=sid)
         return False
+    if refreshed is POSTPONED:
+        return True
 
     current_app.logger.info("Refreshing successful (sid=%s)" % sid)
+    session.update(refreshed)
+    return True
 
-    session["id_token"] = redeemed.id_token
-    session["refresh_token"] = redeemed.refresh_token
-    if redeemed.expires_in:
-        session["refresh_token_expiration"] = (
+
+def _refresh_lock(session_id: str) -> PollingLock:
+    slot = int.from_bytes(
+        hashlib.sha256(session_id.encode()).digest()[:4], "big"
+    ) % REFRESH_LOCKS
+    return named_lock(f"devicepasswords_refresh_{slot}",
+                      timeout=REFRESH_LOCK_TIMEOUT)
+
+
+async def _redeem(oidc: OIDC, data: dict) -> dict | object | None:
+    """Redeem the refresh token of the session data. Return the refreshed
+    session data, POSTPONED if the OIDC provider is unavailable, or None if
+    redeeming failed."""
+    redeemed, e = await oidc.redeem_refresh(data["refresh_token"],
+                                            required_claims())
+    if e is not None and unavailable(e):
+        current_app.logger.warning(
+            "Refreshing postponed (sid=%s): %s" % (data.get("sid"), e)
+        )
+        return POSTPONED
+    if e is not None:
+        current_app.logger.warning(
+            "Refreshing failed (sid=%s)" % data.get("sid"),
+            exc_info=(type(e), e, e.__traceback__)
+        )
+        return None
+
+    refreshed = dict(data)
+    # Providers not rotating refresh tokens may not return it again.
+    refreshed["refresh_token"] = (redeemed.refresh_token or
+                                  data["refresh_token"])
+    if redeemed.refresh_token_expires_in:
+        refreshed["refresh_token_expiration"] = (
                 datetime.now() +
                 timedelta(seconds=redeemed.refresh_token_expires_in)
         )
     else:
-        session["refresh_token_expiration"] = None
+        refreshed["refresh_token_expiration"] = None
 
-    update_session(redeemed.id_token, redeemed.claims, redeemed.profile)
+    update_session(redeemed.id_token, redeemed.claims, redeemed.profile,
+                   refreshed)
+    return refreshed
+
+
+async def _refresh(app: Flask, oidc: OIDC, session_id: str,
+                   data: dict) -> dict | object | None:
+    """Refresh the session, return the refreshed session data, POSTPONED
+    if the OIDC provider is unavailable, or None if the refresh failed.
+
+    Stored sessions are refreshed while holding a lock shared by the
+    workers, and stored right away. Requests of other workers waiting for
+    the lock then use the stored session instead of redeeming the refresh
+    token again, which fails if the OIDC provider rotates refresh tokens.
+    """
+    with app.app_context():
+        interface = app.session_interface
+        if not isinstance(interface, CachedSqlAlchemySessionInterface):
+            return await _redeem(oidc, data)
+
+        try:
+            async with _refresh_lock(session_id):
+                stored = await asyncio.to_thread(interface.load, session_id)
+                if stored is None:
+                    # Logged out meanwhile.
+                    return None
+                if (stored.get("refresh_token") !=
+                        data.get("refresh_token") or
+                        stored.get("exp", 0) > data.get("exp", 0)):
+                    # Refreshed by another worker meanwhile.
+                    return stored
+
+                refreshed = await _redeem(oidc, data)
+                if isinstance(refreshed, dict):
+                    await asyncio.to_thread(interface.store, session_id,
+                                            refreshed)
+                return refreshed
+        except LockTimeoutError as e:
+            current_app.logger.warning(
+                "Refreshing postponed (sid=%s): %s" % (data.get("sid"), e)
+            )
+            return POSTPONED
+
+
+async def _join_refresh(app: Flask, oidc: OIDC, session_id: str,
+                        data: dict) -> dict | object | None:
+    """Refresh the session, or wait for the refresh of the session in
+    progress in this worker. Runs on the background loop, so that the
+    refresh completes even if the request is cancelled."""
+    if (refresh := _refreshes.get(session_id)) is None:
+        refresh = asyncio.ensure_future(_refresh(app, oidc, session_id, data))
+        _refreshes[session_id] = refresh
+        refresh.add_done_callback(lambda _: _refreshes.pop(session_id, None))
+    return await asyncio.shield(refresh)
+
+
+def refresh_token_expiration() -> datetime | None:
+    """Return the expiration of the refresh token of the session."""
+    expiration = session.get("refresh_token_expiration")
+    if isinstance(expiration, str):
+        # Serialized sessions store dates as ISO 8601 strings.
+        return datetime.fromisoformat(expiration)
+    return expiration
 
-    return True
 
+def session_expiration(issued_at: float | None = None) -> datetime:
+    """Return until when the session could be used, including refreshes.
 
-async def destroy_session(sub=None, sid=None):
+    Unknown sessions, e.g. for logouts initiated by the IdP, expire after
+    the session lifetime, counted from issued_at (of the logout token) if
+    given.
+    """
+    start = (datetime.fromtimestamp(issued_at) if issued_at is not None
+             else datetime.now())
+    fallback = start + current_app.permanent_session_lifetime
+    if not session.get("exp"):
+        return fallback
+
+    expires = datetime.fromtimestamp(session["exp"])
+    if session.get("refresh_token"):
+        if (refresh_expiration := refresh_token_expiration()) is None:
+            return fallback
+        expires = max(expires, refresh_expiration)
+    return expires
+
+
+async def destroy_session(sub=None, sid=None,
+                          issued_at: float | None = None):
+    expires = session_expiration(issued_at)
     session.clear()
 
     if sid:
-        db.session.add(Revoked(sid=sid))
-        await sync_to_async(db.session.commit)()
+        await revocations.revoke(sid, expires)
 
 
 def new_session(redeemed: Redeemed):
     session["state"] = secrets.token_urlsafe(16)
-    session["id_token"] = redeemed.id_token
     session["refresh_token"] = redeemed.refresh_token
     session["sid"] = redeemed.claims.get("sid")
     if redeemed.refresh_token_expires_in:
@@ -86,20 +226,34 @@ def new_session(redeemed: Redeemed):
     update_session(redeemed.id_token, redeemed.claims, redeemed.profile)
 
 
-def update_session(id_token, claims, profile):
-    """Update the id_token and the claims of the current message."""
+def required_claims() -> list[str]:
+    """Return the claims required by the session."""
+    config = current_app.config
+    required = [
+        "exp", "iss", "sub", config["OIDC_CLAIM_EMAIL"],
+        config["OIDC_CLAIM_USERNAME"],
+    ]
+    if config.get("OIDC_CLAIM_VERIFIED"):
+        required.append(config["OIDC_CLAIM_VERIFIED"])
+    return required
+
+
+def update_session(id_token, claims, profile, data=None):
+    """Update the id_token and the claims of the current message, or of the
+    given session data.
+
+    Only the claims used by the views are stored, to keep the sessions
+    small.
+    """
     app = current_app
+    if data is None:
+        data = session
 
-    session["token"] = id_token
+    # Sent as hint on logout.
+    data["token"] = id_token
 
-    required = [
-        "exp", "iss", "sub", app.config["OIDC_CLAIM_EMAIL"],
-        app.config["OIDC_CLAIM_USERNAME"],
-    ]
-    if app.config.get("OIDC_CLAIM_VERIFIED"):
-        required.append(app.config["OIDC_CLAIM_VERIFIED"])
     # Validate required claims:
-    for claim in required:
+    for claim in required_claims():
         if not claims.get(claim) and not (
                 app.config.get("OIDC_CLAIMS_FROM_PROFILE") and
                 profile.get(claim)
@@ -110,15 +264,15 @@ def update_session(id_token, claims, profile):
 
     # Always present
     for claim in ["exp", "sub"]:
-        session[claim] = claims[claim]
+        data[claim] = claims[claim]
 
     if claims.get("sid"):
-        session["sid"] = claims["sid"]
+        data["sid"] = claims["sid"]
 
     # Some IdPs only return the (for us mandatory data) in the profile.
-    session["email"] = (claims.get(app.config["OIDC_CLAIM_EMAIL"]) or
-                        profile.get(app.config["OIDC_CLAIM_EMAIL"]))
-    session["preferred_username"] = (
+    data["email"] = (claims.get(app.config["OIDC_CLAIM_EMAIL"]) or
+                     profile.get(app.config["OIDC_CLAIM_EMAIL"]))
+    data["preferred_username"] = (
         claims.get(app.config["OIDC_CLAIM_USERNAME"]) or
         profile.get(app.config["OIDC_CLAIM_USERNAME"])
     )
@@ -126,11 +280,14 @@ def update_session(id_token, claims, profile):
     for claim in ["picture", "name"]:
         if claims.get(claim):
             # Will safely be loaded from profile
-            session[claim] = claims[claim]
+            data[claim] = claims[claim]
         elif profile.get(claim):
-            session[claim] = profile[claim]
+            data[claim] = profile[claim]
+    # Pictures may be inlined as data URLs.
+    if len(data.get("picture") or "") > MAX_PICTURE_LENGTH:
+        del data["picture"]
 
     if app.config.get("OIDC_CLAIM_VERIFIED"):
         if not claims.get(app.config["OIDC_CLAIM_VERIFIED"]):
-            session.clear()
+            data.clear()
             abort(403, "Email not verified")
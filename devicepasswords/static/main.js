@@ -65,7 +65,8 @@ async function refresh() {
             const expires = document.createElement("td")
             expires.innerText = password.expires || "never"
             const lastUsed = document.createElement("td")
-            lastUsed.innerText = "never"
+            lastUsed.innerText = password.last_used || "never"
+            lastUsed.title = `Used ${password.uses} times`
             const remove = document.createElement("a")
             remove.innerText = "🗑"
             remove.href = "#"
@@ -205,6 +206,9 @@ form.onsubmit = async (e) => {
     if (e.currentTarget.expires.checked) {
         data.set("expire", e.currentTarget.expiration.value)
     }
+    if (e.currentTarget.wordlist) {
+        data.set("wordlist", e.currentTarget.wordlist.value)
+    }
     data.set("state", e.currentTarget.state.value)
 
     e.currentTarget.reset()
@@ -0,0 +1,179 @@
+# SPDX-License-Identifier: MPL-2.0
+"""
+Usage recording of device passwords.
+
+Uses are counted in memory and written as aggregated updates of the
+last used time and use counter of each token. Raw log entries, e.g. from
+database-side password validation, can be rolled up into daily counts.
+"""
+import atexit
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, date
+
+import sqlalchemy as sa
+from flask import Flask
+
+from .db import db, Log, Token, Usage
+
+
+def _add_uses(token_id: uuid.UUID, count: int, last_used: datetime) -> None:
+    db.session.execute(
+        db.update(Token)
+        .filter_by(id=token_id)
+        .values(
+            uses=Token.uses + count,
+            last_used=sa.case(
+                (Token.last_used.is_(None), last_used),
+                (Token.last_used < last_used, last_used),
+                else_=Token.last_used
+            )
+        )
+    )
+
+
+def _increment_daily_uses(token_id: uuid.UUID, day: date,
+                          count: int) -> bool:
+    return bool(db.session.execute(
+        db.update(Usage)
+        .filter_by(tokenId=token_id, day=day)
+        .values(count=Usage.count + count)
+    ).rowcount)
+
+
+def _add_daily_uses(token_id: uuid.UUID, day: date, count: int) -> None:
+    if _increment_daily_uses(token_id, day, count):
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(Usage(tokenId=token_id, day=day, count=count))
+    except sa.exc.IntegrityError:
+        # Inserted concurrently, e.g. by a rollup of another node.
+        _increment_daily_uses(token_id, day, count)
+
+
+class UsageRecorder:
+    """Coalesce uses of tokens and flush them periodically."""
+    interval: float = 10
+
+    _app: Flask | None = None
+    _pid: int | None = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._pending: dict[uuid.UUID, tuple[int, datetime]] = {}
+
+    def _start(self) -> None:
+        """Start the flush thread of the current process on first use, or
+        after a fork, e.g. by gunicorn with preloading enabled."""
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # Recorded by the parent, which flushes them itself.
+                with self._lock:
+                    self._pending = {}
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name="usage-flush",
+                             daemon=True).start()
+            atexit.register(self._flush_app)
+
+    def _add(self, token_id: uuid.UUID, count: int, last_used: datetime):
+        with self._lock:
+            pending, pending_last_used = self._pending.get(token_id,
+                                                           (0, last_used))
+            self._pending[token_id] = (pending + count,
+                                       max(pending_last_used, last_used))
+
+    def record(self, token_id: uuid.UUID, when: datetime | None = None):
+        """Record a use of a token without accessing the database."""
+        if self._pid != os.getpid():
+            self._start()
+        self._add(token_id, 1, when or datetime.now())
+
+    def flush(self) -> int:
+        """Write the recorded uses in a single transaction.
+
+        Return the count of updated tokens. Must be called within an app
+        context.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        try:
+            for token_id, (count, last_used) in pending.items():
+                _add_uses(token_id, count, last_used)
+            db.session.commit()
+        except:  # noqa: E722
+            db.session.rollback()
+            # Retry with the next flush.
+            for token_id, (count, last_used) in pending.items():
+                self._add(token_id, count, last_used)
+            raise
+        return len(pending)
+
+    def _flush_app(self) -> None:
+        if self._pid != os.getpid():
+            # Registered by the parent before forking.
+            return
+        with self._app.app_context():
+            self.flush()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                self._flush_app()
+            except:  # noqa: E722
+                logging.getLogger(__name__).error("Cannot record uses.",
+                                                  exc_info=sys.exc_info())
+
+    def init_app(self, app: Flask) -> None:
+        self._app = app
+        self.interval = float(app.config["USAGE_FLUSH_INTERVAL"])
+        if self.interval <= 0:
+            app.logger.error("DP_USAGE_FLUSH_INTERVAL must be positive.")
+            raise ValueError("DP_USAGE_FLUSH_INTERVAL must be positive.")
+
+
+def rollup(before: datetime, batch_size: int = 1000) -> int:
+    """Roll up log entries older than a date into the daily use counts and
+    the use counters of the tokens, then delete them.
+
+    Return the count of rolled up log entries.
+    """
+    rolled_up = 0
+    while logs := db.session.execute(
+            db.select(Log.id, Log.tokenId, Log.date)
+            .filter(Log.date < before)
+            .order_by(Log.id)
+            .limit(batch_size)
+    ).all():
+        daily = defaultdict(int)
+        uses = {}
+        for log in logs:
+            daily[log.tokenId, log.date.date()] += 1
+            count, last_used = uses.get(log.tokenId, (0, log.date))
+            uses[log.tokenId] = (count + 1, max(last_used, log.date))
+
+        for (token_id, day), count in daily.items():
+            _add_daily_uses(token_id, day, count)
+        for token_id, (count, last_used) in uses.items():
+            _add_uses(token_id, count, last_used)
+        db.session.execute(
+            db.delete(Log).filter(Log.id.in_([log.id for log in logs]))
+        )
+        db.session.commit()
+        rolled_up += len(logs)
+    return rolled_up
+
+
+usage = UsageRecorder()
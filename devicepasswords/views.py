@@ -1,25 +1,95 @@
 import asyncio
+import hmac
 import http
 import secrets
 import uuid
 
-from datetime import datetime, date, timedelta
+from datetime import datetime
 
-from asgiref.sync import sync_to_async
+import sqlalchemy as sa
 from flask import (request, redirect, render_template, url_for, session,
                    abort, current_app)
 from flask.blueprints import Blueprint
-from sqlalchemy import func
+from sqlalchemy import func, Row
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
 
 from . import device_passwords, oidc
-from .db import db, User, Token
-from .devpwd import DevicePasswords
-from .pwdhash import hasher
-from .smgmt import valid_session, new_session, destroy_session
+from .adb import adb
+from .db import User, Token, TokenHash, Log
+from .expiration import parse_expiration
+from .hashpool import hash_pool
+from .logins import allocate_login, logins_taken
+from .oidc import unavailable
+from .pwdhash import identify
+from .smgmt import (valid_session, new_session, destroy_session,
+                    required_claims)
+from .usage import usage
 
 views = Blueprint('views', __name__)
 
 
+def _save_user(db_session: Session, sub: str, username: str,
+               email: str) -> None:
+    user = db_session.get(User, sub) or User(sub=sub)
+    user.username = username
+    user.email = email
+    db_session.add(user)
+    db_session.commit()
+
+
+def _list_tokens(db_session: Session, sub: str) -> list[Row]:
+    # Uses are counted on the tokens, and in the logs if written by
+    # database-side validation.
+    return list(db_session.execute(
+        sa.select(Token.id, Token.name, Token.expires,
+                  Token.last_used, Token.uses,
+                  func.max(Log.date).label("logged"),
+                  func.count(Log.id).label("logs"))
+        .outerjoin(Log, Log.tokenId == Token.id)
+        .filter(Token.sub == sub)
+        .group_by(Token.id, Token.name, Token.expires,
+                  Token.last_used, Token.uses)
+    ))
+
+
+def _add_token(db_session: Session, token: Token) -> bool:
+    """Add a token, return False if its login is taken."""
+    db_session.add(token)
+    try:
+        db_session.commit()
+    except IntegrityError:
+        db_session.rollback()
+        if logins_taken(db_session, [token.login]):
+            return False
+        raise
+    return True
+
+
+def _delete_token(db_session: Session, sub: str,
+                  token_id: uuid.UUID) -> str | None:
+    """Delete a token of a user, return its name if it existed."""
+    token = db_session.execute(
+        sa.select(Token).filter_by(sub=sub, id=token_id)
+    ).scalar_one_or_none()
+    if token is None:
+        return None
+    db_session.delete(token)
+    db_session.commit()
+    return token.name
+
+
+def _find_token(db_session: Session, login: str) -> Row | None:
+    """Return the unexpired token of a login and its user."""
+    return db_session.execute(
+        sa.select(Token, User)
+        .join(User, Token.sub == User.sub)
+        .filter(Token.login == login)
+        .filter(sa.or_(Token.expires.is_(None),
+                       Token.expires > datetime.now()))
+    ).one_or_none()
+
+
 @views.route("/")
 async def index():
     """Render the web interface or login."""
@@ -29,7 +99,8 @@ async def index():
             session["state"], url_for("views.login", _external=True)
         ))
 
-    return render_template("index.html")
+    return render_template("index.html",
+                           wordlists=list(device_passwords.wordlists))
 
 
 @views.route("/login", methods=["GET", "POST"])
@@ -47,13 +118,13 @@ async def login():
         abort(400)
 
     redeemed, e = await oidc.redeem_code(
-        code, url_for("views.login", _external=True)
+        code, url_for("views.login", _external=True), required_claims()
     )
     if e is not None:
         current_app.logger.error("Cannot redeem code.", exc_info=(
             type(e), e, e.__traceback__
         ))
-        if isinstance(e, IOError):
+        if unavailable(e):
             abort(http.HTTPStatus.BAD_GATEWAY)
         abort(400)
 
@@ -67,11 +138,8 @@ async def login():
         session.get("sid", "-")
     )
 
-    user = (await sync_to_async(db.session.get)(User, session["sub"])) or User(sub=session["sub"])
-    user.username = session["preferred_username"]
-    user.email = session["email"]
-    db.session.add(user)
-    await sync_to_async(db.session.commit)()
+    await adb.run(_save_user, session["sub"], session["preferred_username"],
+                  session["email"])
 
     return redirect(url_for("views.index"))
 
@@ -89,11 +157,11 @@ async def logout():
     email = session["email"]
 
     if sid := session.get("sid"):
-        await destroy_session(sid)
+        await destroy_session(sid=sid)
     else:
         session.clear()
 
-    if logout_url := await oidc.get_logout_url(
+    if logout_url := oidc.get_logout_url(
             token, email, url_for("views.index", _external=True)
     ):
         return redirect(logout_url)
@@ -133,9 +201,9 @@ async def frontchannel_logout():
     if iss and sid:
         if iss != oidc.config.get("iss"):
             return abort(400, "Invalid issuer.")
-        await destroy_session(sid)
+        await destroy_session(sid=sid)
     elif sid:
-        await destroy_session(sid)
+        await destroy_session(sid=sid)
 
     session.clear()
 
@@ -151,7 +219,7 @@ async def backchannel_logout():
     if not (token := request.form.get("logout_token")):
         abort(400)
 
-    claims, e = oidc.validate_token(token, typ="Logout")
+    claims, e = await oidc.validate(token, typ="Logout")
     if e is not None:
         current_app.logger.error("Cannot validate logout token", exc_info=(
             type(e), e, e.__traceback__
@@ -179,7 +247,9 @@ async def backchannel_logout():
     current_app.logger.info("Backchannel logout (sid=%s, sub=%s)",
                     sid or '-', sub or '-')
 
-    await destroy_session(sid)
+    # The session started before the logout token was issued, and expires
+    # at most a session lifetime later.
+    await destroy_session(sid=sid, issued_at=claims.get("iat"))
     return ""
 
 
@@ -193,15 +263,19 @@ async def tokens():
 
     match request.method:
         case "GET":
-            user_tokens = (await sync_to_async(db.session.execute)(
-                db.select(Token)
-                .filter_by(sub=session["sub"])
-            )).scalars() or []
+            # Uses are counted on the tokens, and in the logs if written by
+            # database-side validation.
+            user_tokens = await adb.run(_list_tokens, session["sub"])
             return [
                 {
                     "id": token.id,
                     "name": token.name,
                     "expires": token.expires,
+                    "last_used": max(
+                        filter(None, (token.last_used, token.logged)),
+                        default=None
+                    ),
+                    "uses": token.uses + token.logs,
                 } for token in user_tokens
             ]
 
@@ -212,66 +286,120 @@ async def tokens():
 
             if not (name := request.form.get("name")):
                 abort(400)
-            if expires := request.form.get("expire"):
-                expires = date.fromisoformat(expires)
-            else:
-                expires = None
-            if ((expiration := current_app.config["PASSWORD_MAX_EXPIRATION_DAYS"])
-                    > 0):
-                maximum = ((datetime.now() + timedelta(days=expiration))
-                           .date())
-                if expires is None or expires > maximum:
-                    expires = maximum
-
-            token_value = device_passwords.generate()
-            for _ in range(128):
-                likely_unique = (
-                    f"{session['preferred_username']}#"
-                    f"{DevicePasswords.random_digits(3)}"
-                )
-                present = (await sync_to_async(db.session.execute)(
-                    db.select(func.count())
-                      .select_from(Token)
-                      .filter_by(login=likely_unique))).scalar()
-                if not present:
-                    break
-            else:
+            try:
+                expires = parse_expiration(request.form.get("expire"))
+            except ValueError:
+                abort(400)
+
+            wordlist = request.form.get("wordlist") or None
+            if (wordlist is not None
+                    and wordlist not in device_passwords.wordlists):
+                abort(400)
+
+            token_value = device_passwords.generate(wordlist)
+            # Hash in all schemes at once while searching for a unique login.
+            schemes = current_app.config["PASSWORD_HASHES"]
+            token_hashes = asyncio.gather(
+                hash_pool.hash(token_value,
+                               current_app.config["PASSWORD_HASH"]),
+                *(hash_pool.hash(token_value, scheme) for scheme in schemes)
+            )
+            try:
+                # Retry if the login was taken concurrently.
+                for _ in range(3):
+                    if (login := await allocate_login(
+                            session["preferred_username"])) is None:
+                        break
+
+                    token_hash, *hashes = await token_hashes
+                    if await adb.run(_add_token, Token(
+                        sub=session["sub"],
+                        name=name,
+                        token=token_hash,
+                        expires=expires,
+                        login=login,
+                        hashes=[
+                            TokenHash(scheme=scheme, hash=scheme_hash)
+                            for scheme, scheme_hash in zip(schemes, hashes)
+                        ],
+                    )):
+                        break
+                else:
+                    login = None
+            finally:
+                # Not needed without a login, or if the request failed.
+                if not token_hashes.done():
+                    token_hashes.cancel()
+
+            if login is None:
                 return {
                     "status": "error",
                     "error": "Cannot create unique identifier",
                 }
 
-            t = Token(
-                sub=session["sub"],
-                name=name,
-                token=hasher.hash(token_value,
-                                  scheme=current_app.config["PASSWORD_HASH"]),
-                expires=expires,
-                login=likely_unique,
-            )
-            db.session.add(t)
-            await sync_to_async(db.session.commit)()
             return {
                 "status": "ok",
-                "login": likely_unique,
+                "login": login,
                 "name": name,
                 "secret": token_value,
             }
 
         case "DELETE":
-            token = (await sync_to_async(db.session.execute)(
-                db.select(Token)
-                .filter_by(
-                    sub=session["sub"],
-                    id=uuid.UUID(request.form.get("id")))
-            )).scalar_one_or_none()
-            if token is None:
+            token_id = uuid.UUID(request.form.get("id"))
+            if (name := await adb.run(_delete_token, session["sub"],
+                                      token_id)) is None:
                 abort(404)
-            db.session.delete(token)
-            await sync_to_async(db.session.commit)()
             return {
-                "id": token.id,
-                "name": token.name,
+                "id": token_id,
+                "name": name,
             }
         case _:
             abort(400)
+
+
+@views.route("/api/verify", methods=["POST"])
+async def verify():
+    """
+    Verify a device password for applications.
+
+    Only active if an API key is configured.
+    """
+    if not (api_key := current_app.config.get("VERIFY_API_KEY")):
+        abort(404)
+    authorization = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(authorization.encode(),
+                               f"Bearer {api_key}".encode()):
+        abort(401)
+
+    args = request.get_json(silent=True) or request.form
+    if not isinstance(args, dict):
+        # JSON, but not an object.
+        abort(400)
+    login = args.get("login")
+    password = args.get("password")
+    if not isinstance(login, str) or not isinstance(password, str):
+        abort(400)
+
+    result = await adb.run(_find_token, login)
+
+    # Tokens keep the scheme they were hashed with, which differs from the
+    # configured scheme if it changed since.
+    if result is None or not await hash_pool.verify(
+            password, result.Token.token, identify(
+                result.Token.token, [current_app.config["PASSWORD_HASH"],
+                                     *current_app.config["PASSWORD_HASHES"]]
+            )
+    ):
+        current_app.logger.info("Invalid device password (login=%s)", login)
+        return {
+            "status": "error",
+            "error": "Invalid credentials",
+        }, http.HTTPStatus.UNAUTHORIZED
+
+    usage.record(result.Token.id)
+    return {
+        "status": "ok",
+        "sub": result.User.sub,
+        "username": result.User.username,
+        "email": result.User.email,
+    }
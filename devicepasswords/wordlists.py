@@ -0,0 +1,126 @@
+# SPDX-License-Identifier: MPL-2.0
+"""
+Memory-mapped wordlists.
+
+All configured wordlists are compiled into a single file, which every
+worker maps read-only, so the words are held in memory once per host. The
+file is only compiled if no file for the same wordlists exists. As the file
+is trusted, it is kept in a private directory (see runtime).
+
+The layout of the file is (all integers are unsigned 32-bit, native order):
+
+    b"DPWL", length of header, header (JSON), padding to 4 bytes,
+    offsets of the words in the pool (words + 1),
+    index of the words of each list,
+    pool of the deduplicated UTF-8 encoded words
+"""
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+from array import array
+from collections.abc import Sequence
+
+from .runtime import open_private, private_directory
+
+MAGIC = b"DPWL"
+
+
+def _read(path: str) -> list[str]:
+    """Return the deduplicated words of a wordlist file."""
+    with open(path, encoding="utf-8") as wl:
+        return list(dict.fromkeys(
+            word for line in wl if (word := line.strip())
+        ))
+
+
+def _compile(lists: dict[str, list[str]]) -> bytes:
+    pool = {}
+    for words in lists.values():
+        for word in words:
+            pool.setdefault(word, len(pool))
+
+    encoded = [word.encode("utf-8") for word in pool]
+    offsets = array("I", [0])
+    for word in encoded:
+        offsets.append(offsets[-1] + len(word))
+
+    header = {"words": len(pool), "lists": {}}
+    indices = array("I")
+    for name, words in lists.items():
+        header["lists"][name] = [len(indices), len(words)]
+        indices.extend(pool[word] for word in words)
+
+    header = json.dumps(header).encode()
+    header += b" " * (-(len(MAGIC) + 4 + len(header)) % 4)
+    return b"".join((
+        MAGIC, array("I", [len(header)]).tobytes(), header,
+        offsets.tobytes(), indices.tobytes(), b"".join(encoded),
+    ))
+
+
+def compile_wordlists(sources: dict[str, str], directory: str) -> str:
+    """Compile wordlist files into a single file in the private directory
+    and return its path. An existing file of the same, unmodified wordlists
+    is reused."""
+    key = hashlib.sha256(json.dumps([
+        (name, os.path.realpath(source), os.stat(source).st_mtime_ns,
+         os.stat(source).st_size)
+        for name, source in sources.items()
+    ]).encode()).hexdigest()
+    path = os.path.join(private_directory(directory),
+                        f"wordlists-{key[:32]}.bin")
+    if os.path.exists(path):
+        return path
+
+    lists = {name: _read(source) for name, source in sources.items()}
+    with tempfile.NamedTemporaryFile(dir=directory, delete=False) as tmp:
+        tmp.write(_compile(lists))
+    # Concurrent workers write the same content, the last one wins.
+    os.replace(tmp.name, path)
+    return path
+
+
+class Wordlist(Sequence):
+    """Read-only list of words of a compiled wordlist file."""
+
+    def __init__(self, pool: memoryview, offsets: memoryview,
+                 indices: memoryview):
+        self._pool = pool
+        self._offsets = offsets
+        self._indices = indices
+
+    def __len__(self) -> int:
+        return len(self._indices)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        word = self._indices[i]
+        return str(self._pool[self._offsets[word]:self._offsets[word + 1]],
+                   "utf-8")
+
+
+def load_wordlists(path: str) -> dict[str, Wordlist]:
+    """Map a compiled wordlist file and return its wordlists by name."""
+    with open(open_private(path), "rb") as f:
+        blob = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    if bytes(blob[:len(MAGIC)]) != MAGIC:
+        raise ValueError(f"Not a compiled wordlist: {path}")
+    start = len(MAGIC) + 4
+    length = blob[len(MAGIC):start].cast("I")[0]
+    header = json.loads(bytes(blob[start:start + length]))
+
+    start += length
+    offsets = blob[start:start + 4 * (header["words"] + 1)].cast("I")
+    start += offsets.nbytes
+    count = sum(size for _, size in header["lists"].values())
+    indices = blob[start:start + 4 * count].cast("I")
+    pool = blob[start + indices.nbytes:]
+
+    return {
+        name: Wordlist(pool, offsets, indices[first:first + size])
+        for name, (first, size) in header["lists"].items()
+    }
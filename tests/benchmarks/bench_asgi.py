@@ -0,0 +1,161 @@
+# SPDX-License-Identifier:  CC0-1.0
+"""
+Load benchmark of the API endpoints served via ASGI.
+
+Compares the requests per second of the WSGI app bridged by WsgiToAsgi
+with the native ASGI app. The app uses a temporary SQLite database and
+cached metadata of a fictional OIDC provider, and requests are sent in the
+same process. The round trip time of a database server can be simulated
+by delaying the database accesses of the views.
+
+Run from the source directory:
+
+    python -m tests.benchmarks.bench_asgi [--count N] [--concurrency N]
+        [--latency MS]
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from asgiref.wsgi import WsgiToAsgi
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk
+
+DISCOVERY_URL = "https://idp.invalid/.well-known/openid-configuration"
+JWKS_URL = "https://idp.invalid/jwks"
+
+
+def setup(directory: str) -> None:
+    """Configure the app by environment variables, with cached metadata so
+    that the OIDC provider is not contacted."""
+    cache_file = os.path.join(directory, "oidc.json")
+    expires = time.time() + 86400
+    pem = rsa.generate_private_key(65537, 2048).private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    )
+    key = {**jwk.construct(pem, "RS256").public_key().to_dict(),
+           "kid": "bench", "use": "sig"}
+    with open(cache_file, "w") as f:
+        json.dump({
+            DISCOVERY_URL: {"body": {
+                "issuer": "https://idp.invalid",
+                "jwks_uri": JWKS_URL,
+                "authorization_endpoint": "https://idp.invalid/auth",
+                "token_endpoint": "https://idp.invalid/token",
+            }, "etag": None, "last_modified": None, "expires": expires},
+            JWKS_URL: {"body": {"keys": [key]}, "etag": None,
+                       "last_modified": None, "expires": expires},
+        }, f)
+
+    os.environ.update({
+        "DP_OIDC_DISCOVERY_URL": DISCOVERY_URL,
+        "DP_OIDC_CLIENT_ID": "bench",
+        "DP_OIDC_CLIENT_SECRET": "bench",
+        "DP_OIDC_CACHE_FILE": cache_file,
+        "DP_SECRET_KEY": hashlib.sha256(directory.encode()).hexdigest(),
+        "DP_SQLALCHEMY_DATABASE_URI":
+            f"sqlite:///{os.path.join(directory, 'bench.sqlite')}",
+    })
+
+
+def login(app) -> bytes:
+    """Return the cookie header of a logged in session."""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session.update({
+            "sub": "bench", "sid": "bench", "state": "bench",
+            "exp": int(time.time()) + 3600,
+            "email": "bench@example.com", "preferred_username": "bench",
+        })
+    return f"session={client.get_cookie('session').value}".encode()
+
+
+async def request(app, path: str, cookie: bytes) -> int:
+    """Send a GET request to the ASGI app, return the status code."""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": path, "root_path": "",
+        "query_string": b"", "server": ("localhost", 80),
+        "client": ("127.0.0.1", 50000),
+        "headers": [(b"host", b"localhost"), (b"cookie", cookie)],
+    }
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+    status = None
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.Event().wait()  # Never disconnect.
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+
+async def requests_per_second(app, path: str, cookie: bytes, count: int,
+                              concurrency: int) -> float:
+    """Return the requests per second of concurrent requests."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited():
+        async with semaphore:
+            return await request(app, path, cookie)
+
+    start = time.perf_counter()
+    statuses = await asyncio.gather(*(limited() for _ in range(count)))
+    elapsed = time.perf_counter() - start
+    assert all(status == 200 for status in statuses), statuses
+    return count / elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=500,
+                        help="requests per endpoint and mode")
+    parser.add_argument("--concurrency", type=int, default=50,
+                        help="concurrent requests")
+    parser.add_argument("--latency", type=float, default=0,
+                        help="simulated milliseconds per database access")
+    parser.add_argument("paths", nargs="*",
+                        default=["/api/ping", "/api/tokens"])
+    args = parser.parse_args()
+
+    setup(tempfile.mkdtemp())
+    from devicepasswords import create_app
+    from devicepasswords.adb import AsyncDatabase
+    from devicepasswords.asgi import AsgiApp
+
+    if args.latency:
+        run = AsyncDatabase.run
+
+        async def delayed(self, *args_, **kwargs):
+            await asyncio.sleep(args.latency / 1000)
+            return await run(self, *args_, **kwargs)
+        AsyncDatabase.run = delayed
+
+    app = create_app()
+    cookie = login(app)
+    modes = {"WsgiToAsgi": WsgiToAsgi(app), "native": AsgiApp(app)}
+
+    print(f"{'endpoint':<16} {'mode':<12} {'requests/s':>12}")
+    for path in args.paths:
+        for mode, asgi_app in modes.items():
+            # Warm up connections and caches before measuring.
+            await requests_per_second(asgi_app, path, cookie, 10, 10)
+            rate = await requests_per_second(asgi_app, path, cookie,
+                                             args.count, args.concurrency)
+            print(f"{path:<16} {mode:<12} {rate:>12.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,56 @@
+# SPDX-License-Identifier:  CC0-1.0
+"""
+Benchmark of hashing and verifying with every supported scheme.
+
+Run from the source directory:
+
+    python -m tests.benchmarks.bench_hashes [--repeat N] [scheme ...]
+"""
+import argparse
+import statistics
+import time
+from typing import Callable
+
+from passlib.exc import MissingBackendError
+
+from devicepasswords.pwdhash import hasher
+
+SECRET = "correct-horse-battery-staple-12345"
+
+
+def median_ms(function: Callable[[], object], repeat: int) -> float:
+    """Return the median duration of a function call in milliseconds."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="measurements per scheme and operation")
+    parser.add_argument("schemes", nargs="*", default=hasher.schemes())
+    args = parser.parse_args()
+
+    print(f"{'scheme':<24} {'hash (ms)':>12} {'verify (ms)':>12}")
+    for scheme in args.schemes:
+        try:
+            hash = hasher.hash(SECRET, scheme=scheme)
+        except MissingBackendError:
+            print(f"{scheme:<24} {'(no backend)':>12}")
+            continue
+        assert hasher.verify(SECRET, hash, scheme=scheme)
+
+        hashing = median_ms(lambda: hasher.hash(SECRET, scheme=scheme),
+                            args.repeat)
+        verifying = median_ms(
+            lambda: hasher.verify(SECRET, hash, scheme=scheme), args.repeat
+        )
+        print(f"{scheme:<24} {hashing:>12.3f} {verifying:>12.3f}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# SPDX-License-Identifier:  CC0-1.0
+"""
+Load benchmark of the password verification pool.
+
+Run from the source directory:
+
+    python -m tests.benchmarks.bench_verify [--count N] [--workers N]
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from passlib.exc import MissingBackendError
+
+from devicepasswords.hashpool import HashPool
+from devicepasswords.pwdhash import hasher
+
+SECRET = "correct-horse-battery-staple-12345"
+
+
+async def verifications_per_second(pool: HashPool, hash: str, scheme: str,
+                                   count: int) -> float:
+    """Return the verifications per second of concurrent verifications."""
+    start = time.perf_counter()
+    results = await asyncio.gather(*(
+        pool.verify(SECRET, hash, scheme) for _ in range(count)
+    ))
+    elapsed = time.perf_counter() - start
+    assert all(results)
+    return count / elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=200,
+                        help="verifications per scheme")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="size of the process pool")
+    parser.add_argument("schemes", nargs="*", default=hasher.schemes())
+    args = parser.parse_args()
+
+    pool = HashPool()
+    pool.workers = args.workers
+    # Start the workers before measuring.
+    await pool.verify(SECRET, SECRET, "plaintext")
+
+    print(f"{'scheme':<24} {'verifications/s':>16}")
+    for scheme in args.schemes:
+        try:
+            hash = hasher.hash(SECRET, scheme=scheme)
+        except MissingBackendError:
+            print(f"{scheme:<24} {'(no backend)':>16}")
+            continue
+        rate = await verifications_per_second(pool, hash, scheme,
+                                              args.count)
+        print(f"{scheme:<24} {rate:>16.1f}", flush=True)
+
+    pool.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
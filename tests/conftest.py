@@ -0,0 +1,93 @@
+# SPDX-License-Identifier:  CC0-1.0
+"""
+App fixtures.
+
+The app uses a temporary SQLite database and cached metadata of a fictional
+OIDC provider, so that the OIDC provider is not contacted.
+"""
+import json
+import os
+import time
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk
+
+ISSUER = "https://idp.invalid"
+
+
+@pytest.fixture
+def app_env(tmp_path, monkeypatch):
+    """Configure the app by environment variables, return them."""
+    cache_file = tmp_path / "oidc.json"
+    pem = rsa.generate_private_key(65537, 2048).private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    )
+    key = {**jwk.construct(pem, "RS256").public_key().to_dict(),
+           "kid": "test", "use": "sig"}
+    expires = time.time() + 86400
+    discovery_url = f"{ISSUER}/.well-known/openid-configuration"
+    cache_file.write_text(json.dumps({
+        discovery_url: {"body": {
+            "issuer": ISSUER,
+            "jwks_uri": f"{ISSUER}/jwks",
+            "authorization_endpoint": f"{ISSUER}/auth",
+            "token_endpoint": f"{ISSUER}/token",
+        }, "etag": None, "last_modified": None, "expires": expires},
+        f"{ISSUER}/jwks": {"body": {"keys": [key]}, "etag": None,
+                           "last_modified": None, "expires": expires},
+    }))
+    os.chmod(cache_file, 0o600)
+
+    env = {
+        "DP_OIDC_DISCOVERY_URL": discovery_url,
+        "DP_OIDC_CLIENT_ID": "client",
+        "DP_OIDC_CLIENT_SECRET": "secret",
+        "DP_OIDC_CACHE_FILE": str(cache_file),
+        "DP_RUNTIME_DIR": str(tmp_path / "run"),
+        "DP_SECRET_KEY": "secret",
+        "DP_SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'db.sqlite'}",
+        "DP_WORDLIST": os.path.join(os.path.dirname(__file__), "..",
+                                    "wordlist.txt"),
+        "DP_HASH_WORKERS": "1",
+    }
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    return env
+
+
+@pytest.fixture
+def create_app(app_env):
+    """Return the app factory, which may be called repeatedly."""
+    from devicepasswords import create_app
+    from devicepasswords.db import db
+
+    def create():
+        # Flask-Session defines the sessions table again for each app.
+        if "sessions" in db.metadata.tables:
+            db.metadata.remove(db.metadata.tables["sessions"])
+        return create_app()
+    return create
+
+
+@pytest.fixture
+def app(create_app):
+    return create_app()
+
+
+@pytest.fixture
+def login(app):
+    """Return a function logging in a test client."""
+    def login(sub="alice", **claims):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session.update({
+                "sub": sub, "sid": f"{sub}-session", "state": "state",
+                "exp": int(time.time()) + 3600,
+                "email": f"{sub}@example.com", "preferred_username": sub,
+                **claims,
+            })
+        return client
+    return login
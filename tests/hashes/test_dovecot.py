@@ -22,4 +22,32 @@ def test_scram_sha256():
         ('{SCRAM-SHA-256}4096,2LdpQgqFUFMdV63SS9XgnQ==,'
          '1lqxQc6gqLHXXuycpPlLyvb8AUSuxBfmZlqaJGzFDOI=,'
          'j+dSYp5a1uwOD6HLuzKvnJSmGeKJuJCLQmN80MCEeS0=')
-    )
\ No newline at end of file
+    )
+
+
+def test_scram_roundtrip():
+    context = CryptContext(schemes=["dovecot_scram_sha256"])
+    hash = context.hash("ahch0Eib")
+    assert hash.startswith("{SCRAM-SHA-256}200000,")
+    assert context.verify("ahch0Eib", hash)
+    assert not context.verify("ahch0Eic", hash)
+
+
+def test_scram_malformed():
+    context = CryptContext(schemes=["dovecot_scram_sha1"])
+    assert not context.verify("IeDahgai", "{SCRAM-SHA-1}4096,YLq6hzinvC13")
+    assert not context.verify("IeDahgai", "{SCRAM-SHA-1}x,a,b,c")
+    for rounds in ["0", "-1"]:
+        assert not context.verify("IeDahgai", (
+            f"{{SCRAM-SHA-1}}{rounds},YLq6hzinvC13hpOtiYrY6w==,"
+            "U2vQpW46v6506Zsab9NTlPv/jbk=,cJxnNAQ5EeLhLAk6IB8ymube7TU="
+        ))
+
+
+def test_scram_silent(capsys):
+    CryptContext(schemes=["dovecot_scram_sha1"]).verify(
+        'IeDahgai',
+        ('{SCRAM-SHA-1}4096,YLq6hzinvC13hpOtiYrY6w==,'
+         'U2vQpW46v6506Zsab9NTlPv/jbk=,cJxnNAQ5EeLhLAk6IB8ymube7TU=')
+    )
+    assert capsys.readouterr().out == ""
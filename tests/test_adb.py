@@ -0,0 +1,46 @@
+# SPDX-License-Identifier:  CC0-1.0
+"""
+Test the URLs of the async database engine.
+"""
+import importlib.util
+
+import pytest
+
+from devicepasswords.adb import async_url
+
+
+@pytest.fixture
+def drivers(monkeypatch):
+    """Pretend the async drivers are installed."""
+    find_spec = importlib.util.find_spec
+    monkeypatch.setattr(importlib.util, "find_spec", lambda name: (
+        True if name in ("asyncpg", "aiomysql") else find_spec(name)
+    ))
+
+
+def test_sqlite():
+    url, connect_args = async_url("sqlite:///db.sqlite?timeout=30")
+    assert url.drivername == "sqlite+aiosqlite"
+    assert url.query == {"timeout": "30"}
+    assert connect_args == {}
+
+
+def test_translated(drivers):
+    url, connect_args = async_url(
+        "postgresql://user@db/dp?sslmode=verify-full&connect_timeout=10"
+    )
+    assert url.render_as_string() == "postgresql+asyncpg://user@db/dp"
+    assert connect_args == {"ssl": "verify-full", "timeout": 10.0}
+
+    url, connect_args = async_url(
+        "mysql+pymysql://user@db/dp?charset=utf8mb4&connect_timeout=10"
+    )
+    assert url.render_as_string() == "mysql+aiomysql://user@db/dp"
+    assert connect_args == {"charset": "utf8mb4", "connect_timeout": 10}
+
+
+def test_unsupported(drivers):
+    # Run in threads with the sync driver instead.
+    assert async_url("postgresql://db/dp?sslrootcert=ca.pem") is None
+    assert async_url("mysql://db/dp?ssl_ca=ca.pem") is None
+    assert async_url("oracle://db/dp") is None
@@ -0,0 +1,90 @@
+# SPDX-License-Identifier:  CC0-1.0
+"""
+Test device password generation.
+"""
+import math
+import os
+import re
+import stat
+
+import pytest
+
+from devicepasswords.devpwd import DevicePasswords, random_below
+from devicepasswords.wordlists import compile_wordlists, load_wordlists
+
+
+def test_random_below():
+    values = random_below(10, 10_000)
+    assert len(values) == 10_000
+    assert set(values) == set(range(10))
+
+
+def test_random_below_large_bound():
+    values = random_below(7776, 1000)
+    assert len(values) == 1000
+    assert all(0 <= value < 7776 for value in values)
+
+
+def test_random_below_bounds():
+    assert random_below(1, 10) == [0] * 10
+    assert len(random_below(1 << 32, 10)) == 10
+    for bound in (0, -1, (1 << 32) + 1):
+        with pytest.raises(ValueError):
+            random_below(bound, 1)
+
+
+def test_generate_many():
+    words = ["alpha", "bravo", "charlie", "delta"]
+    generator = DevicePasswords(words, digits=5, entropy=64)
+    wordcount = math.ceil((64 - math.log2(10) * 5) / 2)
+
+    passwords = generator.generate_many(100)
+    assert len(passwords) == 100
+    for password in passwords:
+        *chosen, digits = password.split("-")
+        assert len(chosen) == wordcount
+        assert set(chosen) <= set(words)
+        assert re.fullmatch(r"\d{5}", digits)
+
+
+def test_generate():
+    generator = DevicePasswords(["alpha", "bravo"], digits=3, entropy=16)
+    assert re.fullmatch(r"([a-z]+-)+\d{3}", generator.generate())
+
+
+def test_wordlists(tmp_path):
+    (tmp_path / "en.txt").write_text("alpha\nbravo\n\nalpha\ncharlie\n")
+    (tmp_path / "de.txt").write_text("anton\nbravo\ncäsar\n")
+    path = compile_wordlists({"en": str(tmp_path / "en.txt"),
+                              "de": str(tmp_path / "de.txt")},
+                             str(tmp_path / "cache"))
+    assert compile_wordlists({"en": str(tmp_path / "en.txt"),
+                              "de": str(tmp_path / "de.txt")},
+                             str(tmp_path / "cache")) == path
+
+    wordlists = load_wordlists(path)
+    assert list(wordlists["en"]) == ["alpha", "bravo", "charlie"]
+    assert list(wordlists["de"]) == ["anton", "bravo", "cäsar"]
+
+    generator = DevicePasswords(digits=3, entropy=16)
+    for name, words in wordlists.items():
+        generator.add_wordlist(name, words)
+    assert set(generator.generate("de").split("-")[:-1]) <= set(
+        wordlists["de"])
+
+
+def test_wordlists_private(tmp_path):
+    (tmp_path / "en.txt").write_text("alpha\nbravo\n")
+    cache = tmp_path / "cache"
+    path = compile_wordlists({"en": str(tmp_path / "en.txt")}, str(cache))
+    assert stat.S_IMODE(os.stat(cache).st_mode) == 0o700
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+    # Other users could replace the compiled wordlist.
+    os.chmod(cache, 0o777)
+    with pytest.raises(PermissionError):
+        compile_wordlists({"en": str(tmp_path / "en.txt")}, str(cache))
+    os.chmod(cache, 0o700)
+    os.chmod(path, 0o666)
+    with pytest.raises(PermissionError):
+        load_wordlists(path)
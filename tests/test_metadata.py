@@ -0,0 +1,45 @@
+# SPDX-License-Identifier:  CC0-1.0
+"""
+Test the shared cache of the OIDC metadata.
+"""
+import os
+import stat
+
+import pytest
+
+from devicepasswords.metadata import MetadataCache
+from devicepasswords.runtime import private_directory
+
+DOCUMENTS = {"https://idp.invalid/jwks": {"body": {"keys": []}}}
+
+
+def test_private_files(tmp_path):
+    cache = MetadataCache(str(tmp_path / "run" / "oidc.json"))
+    cache.save(DOCUMENTS)
+    with cache.lock():
+        pass
+    assert cache.load() == DOCUMENTS
+    assert stat.S_IMODE(os.stat(tmp_path / "run").st_mode) == 0o700
+    for name in ["oidc.json", "oidc.json.lock"]:
+        mode = os.stat(tmp_path / "run" / name).st_mode
+        assert stat.S_IMODE(mode) == 0o600
+
+
+def test_refuse_shared_files(tmp_path):
+    cache = MetadataCache(str(tmp_path / "oidc.json"))
+    cache.save(DOCUMENTS)
+    os.chmod(cache.path, 0o666)
+    assert cache.load() == {}
+
+    # Not followed, other users could replace the link.
+    os.chmod(cache.path, 0o600)
+    os.symlink(cache.path, tmp_path / "link.json")
+    assert MetadataCache(str(tmp_path / "link.json")).load() == {}
+
+
+def test_refuse_shared_directory(tmp_path):
+    os.chmod(tmp_path, 0o777)
+    with pytest.raises(PermissionError):
+        private_directory(str(tmp_path))
+    with pytest.raises(PermissionError):
+        MetadataCache(str(tmp_path / "oidc.json")).save(DOCUMENTS)
@@ -0,0 +1,86 @@
+# SPDX-License-Identifier:  CC0-1.0
+"""
+Test the Prometheus metrics.
+
+The metrics are created once per process, so all tests share the metrics
+directory.
+"""
+import os
+
+import pytest
+
+from devicepasswords.metrics import _server_run, clear_stale
+
+
+@pytest.fixture(scope="module")
+def metrics_dir(tmp_path_factory):
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        directory = tmp_path_factory.mktemp("metrics")
+        monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(directory))
+        yield directory
+
+
+@pytest.fixture
+def app(metrics_dir, create_app, monkeypatch):
+    # Imported after setting the directory, like by the app.
+    pytest.importorskip("prometheus_client")
+    monkeypatch.setenv("DP_METRICS", "true")
+    monkeypatch.setenv("DP_METRICS_API_KEY", "key")
+    return create_app()
+
+
+def scrape(client) -> dict[str, float]:
+    response = client.get("/metrics", headers={"Authorization": "Bearer key"})
+    assert response.status_code == 200
+    samples = {}
+    for line in response.text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+def test_api_key(app):
+    client = app.test_client()
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={
+        "Authorization": "Bearer wrong"
+    }).status_code == 401
+    response = client.get("/metrics",
+                          headers={"Authorization": "Bearer key"})
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain")
+
+
+def test_instrumentation(app, login):
+    client = login()
+    assert client.post("/api/tokens", data={
+        "name": "phone", "state": "state"
+    }).json["status"] == "ok"
+    assert client.get("/api/tokens").status_code == 200
+
+    samples = scrape(client)
+    assert samples['devicepasswords_request_duration_seconds_count'
+                   '{endpoint="views.tokens",status="200"}'] >= 2
+    assert samples['devicepasswords_request_db_accesses_count'
+                   '{endpoint="views.tokens"}'] >= 2
+    assert samples['devicepasswords_hash_duration_seconds_count'
+                   '{operation="hash",scheme="plaintext"}'] >= 1
+    assert samples['devicepasswords_revocation_lookups_total'
+                   '{result="miss"}'] >= 1
+    assert samples["devicepasswords_db_query_duration_seconds_count"] > 0
+    assert samples["devicepasswords_hash_pending"] == 0
+
+
+def test_clear_stale(tmp_path):
+    (tmp_path / "counter_1.db").write_bytes(b"")
+    (tmp_path / "run").write_text("previous run")
+    os.chmod(tmp_path / "run", 0o600)
+    clear_stale(str(tmp_path))
+    assert not (tmp_path / "counter_1.db").exists()
+    assert (tmp_path / "run").read_text() == _server_run()
+
+    # Files of the current run are kept.
+    (tmp_path / "counter_2.db").write_bytes(b"")
+    clear_stale(str(tmp_path))
+    assert (tmp_path / "counter_2.db").exists()
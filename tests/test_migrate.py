@@ -0,0 +1,21 @@
+# SPDX-License-Identifier:  CC0-1.0
+"""
+Test the migration on startup.
+"""
+from alembic.script import ScriptDirectory
+
+from devicepasswords.migrate import at_head
+
+
+def test_heads_cached(app, create_app, monkeypatch, tmp_path):
+    alembic = app.extensions["alembic"]
+    assert list((tmp_path / "run").glob("migrations-*.json"))
+
+    def get_heads(self):
+        raise AssertionError("Migration scripts loaded")
+    monkeypatch.setattr(ScriptDirectory, "get_heads", get_heads)
+    with app.app_context():
+        assert at_head(alembic)
+
+    # Started without loading the scripts.
+    create_app()
@@ -0,0 +1,197 @@
+# SPDX-License-Identifier:  CC0-1.0
+"""
+Test validation of OpenID Connect tokens.
+"""
+import asyncio
+import importlib
+import time
+
+import aiohttp
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+
+from devicepasswords.breaker import CircuitBreaker, CircuitOpenError
+from devicepasswords.oidc import OIDC
+
+# The package exports the client as oidc.
+oidc_module = importlib.import_module("devicepasswords.oidc")
+
+
+def make_key(kid: str) -> tuple[str, dict]:
+    pem = rsa.generate_private_key(65537, 2048).private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    ).decode()
+    public = jwk.construct(pem, "RS256").public_key().to_dict()
+    return pem, {**public, "kid": kid, "use": "sig"}
+
+
+def make_oidc(*certs: dict) -> OIDC:
+    oidc = OIDC()
+    oidc.client_id = "client"
+    oidc.client_secret = "secret"
+    oidc.config = {"issuer": "https://idp.example"}
+    oidc.set_keys({"keys": list(certs)})
+    return oidc
+
+
+def sign(pem: str, kid: str, **claims) -> str:
+    return jwt.encode({
+        "iss": "https://idp.example", "aud": "client", "sub": "alice",
+        "exp": int(time.time()) + 60, **claims
+    }, pem, "RS256", headers={"kid": kid})
+
+
+def test_validate_by_kid():
+    old_pem, old = make_key("old")
+    new_pem, new = make_key("new")
+    oidc = make_oidc(old, new)
+
+    claims, e = oidc.validate_token(sign(new_pem, "new"))
+    assert e is None and claims["sub"] == "alice"
+
+    # Only the key of the kid is tried.
+    claims, e = oidc.validate_token(sign(new_pem, "old"))
+    assert claims is None and e is not None
+
+    claims, e = oidc.validate_token(sign(new_pem, "unknown"))
+    assert claims is None and "Unknown key" in str(e)
+
+
+def test_validated_token_cache():
+    pem, cert = make_key("key")
+    oidc = make_oidc(cert)
+    token = sign(pem, "key", typ="Logout")
+
+    assert oidc.validate_token(token, typ="Logout")[1] is None
+    assert len(oidc._tokens) == 1
+    assert oidc.validate_token(token, typ="Logout")[1] is None
+    # The type is checked for cached tokens, too.
+    assert oidc.validate_token(token)[0] is None
+
+    # Replacing the keys invalidates the cache.
+    oidc.set_keys({"keys": [make_key("other")[1]]})
+    assert oidc.validate_token(token, typ="Logout")[0] is None
+
+
+def test_userinfo_only_for_missing_claims():
+    pem, cert = make_key("key")
+    oidc = make_oidc(cert)
+    oidc.config.update(token_endpoint="https://idp.example/token",
+                       token_endpoint_auth_methods_supported=[
+                           "client_secret_post"
+                       ],
+                       userinfo_endpoint="https://idp.example/userinfo")
+    calls = []
+
+    async def fetch(method, url, **kwargs):
+        calls.append(url.rsplit("/", 1)[1])
+        if url == oidc.config["token_endpoint"]:
+            return {"id_token": sign(pem, "key", email="a@example.com"),
+                    "access_token": "at"}
+        return {"sub": "alice", "name": "Alice"}
+    oidc._fetch = fetch
+
+    redeemed, e = asyncio.run(oidc.redeem_code("code", "/", ["email"]))
+    assert e is None and redeemed.profile == {}
+    assert calls == ["token"]
+
+    redeemed, e = asyncio.run(oidc.redeem_code("code", "/", ["name"]))
+    assert e is None and redeemed.profile["name"] == "Alice"
+    assert calls == ["token", "token", "userinfo"]
+
+    # Refreshes reuse the userinfo of the subject.
+    redeemed, e = asyncio.run(oidc.redeem_refresh("refresh", ["name"]))
+    assert e is None and redeemed.profile["name"] == "Alice"
+    assert calls == ["token", "token", "userinfo", "token"]
+
+
+def test_userinfo_errors():
+    pem, cert = make_key("key")
+    oidc = make_oidc(cert)
+    oidc.config.update(token_endpoint="https://idp.example/token",
+                       userinfo_endpoint="https://idp.example/userinfo")
+
+    async def fetch(method, url, **kwargs):
+        if url == oidc.config["token_endpoint"]:
+            return {"id_token": sign(pem, "key"), "access_token": "at"}
+        # Raised for the status by the client session.
+        raise aiohttp.ClientResponseError(None, (), status=401)
+    oidc._fetch = fetch
+
+    redeemed, e = asyncio.run(oidc.redeem_code("code", "/", ["name"]))
+    assert isinstance(e, aiohttp.ClientResponseError)
+    assert redeemed.claims == {}
+
+
+def test_stats():
+    oidc = OIDC()
+
+    async def stats():
+        oidc.session
+        try:
+            return oidc.stats
+        finally:
+            await oidc.close()
+    assert asyncio.run(stats()) == {"requests": 0, "connections": 0,
+                                    "reused": 0, "active": 0, "idle": 0}
+
+
+def test_stale_metadata_dropped():
+    oidc = OIDC()
+    oidc.configuration_url = "https://idp.example/config"
+    expires = time.time() + 60
+    config = {"jwks_uri": "https://idp.example/v2"}
+    documents = {
+        oidc.configuration_url: {"body": config, "etag": None,
+                                 "last_modified": None, "expires": expires},
+        "https://idp.example/v2": {"body": {"keys": [make_key("key")[1]]},
+                                   "etag": None, "last_modified": None,
+                                   "expires": expires},
+        # Referenced by a previous configuration.
+        "https://idp.example/v1": {"body": {"keys": []}, "etag": None,
+                                   "last_modified": None, "expires": 0},
+    }
+    assert oidc._adopt(documents)
+    assert oidc._metadata.keys() == {oidc.configuration_url,
+                                     "https://idp.example/v2"}
+
+
+def test_refresher_per_process(monkeypatch):
+    started = []
+
+    def submit(coro):
+        started.append(coro)
+        coro.close()
+    monkeypatch.setattr(oidc_module.background, "submit", submit)
+    oidc = OIDC()
+    oidc.refresh = True
+    oidc.start_refresher()
+    assert len(started) == 1
+
+    # Forked, e.g. by gunicorn with preloading enabled.
+    monkeypatch.setattr(oidc_module.os, "getpid", lambda: -1)
+    oidc.start_refresher()
+    oidc.start_refresher()
+    assert len(started) == 2
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker(threshold=2, reset_timeout=0.1)
+    breaker.failure()
+    breaker.before_request()
+    breaker.failure()
+    assert breaker.open
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+
+    # A single trial request is sent after the reset timeout.
+    time.sleep(0.1)
+    breaker.before_request()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+    breaker.success()
+    assert not breaker.open
+    breaker.before_request()
@@ -0,0 +1,44 @@
+# SPDX-License-Identifier:  CC0-1.0
+"""
+Test reading the records of the bulk provisioning.
+"""
+import io
+from datetime import date
+
+import pytest
+
+from devicepasswords.provision import read_records
+
+ALICE = ('{"sub": "alice", "username": "alice", '
+         '"email": "alice@example.com", "name": "phone"')
+
+
+def test_read_records(app):
+    csv = ("sub,username,email,name,expires\n"
+           "alice,alice,alice@example.com,phone,2030-01-01\n"
+           "bob,bob,bob@example.com,phone,\n")
+    ndjson = (ALICE + ', "expires": "2030-01-01"}\n\n'
+              '{"sub": "bob", "username": "bob", "email": "bob@example.com", '
+              '"name": "phone", "expires": null}\n')
+    with app.app_context():
+        for records, fmt in ((csv, "csv"), (ndjson, "ndjson")):
+            records = list(read_records(io.StringIO(records), fmt))
+            assert [record["expires"] for record in records] == [
+                date(2030, 1, 1), None
+            ]
+            assert records[0]["email"] == "alice@example.com"
+
+
+@pytest.mark.parametrize("line, error", [
+    (ALICE + ', "expires": 20300101}', "Invalid date 20300101"),
+    (ALICE + ', "expires": "tomorrow"}', "Invalid isoformat"),
+    ('{"sub": "bob", "username": "bob"}', "missing email, name"),
+    (ALICE.replace('"phone"', '["phone"]') + "}", "name must be strings"),
+    ('["alice"]', "not an object"),
+    ("{", "Expecting property name"),
+])
+def test_invalid_records(app, line, error):
+    with app.app_context(), pytest.raises(ValueError, match=error) as e:
+        list(read_records(io.StringIO(ALICE + "}\n" + line + "\n"),
+                          "ndjson"))
+    assert str(e.value).startswith("Record 2: ")
@@ -0,0 +1,31 @@
+# SPDX-License-Identifier:  CC0-1.0
+"""
+Test the background deletion of expired rows.
+"""
+import importlib
+
+# Imported as module, like the other tests of singletons.
+retention = importlib.import_module("devicepasswords.retention")
+
+
+def test_sweeper_per_process(app, monkeypatch):
+    started = []
+
+    class Thread:
+        def __init__(self, target, **kwargs):
+            self.target = target
+
+        def start(self):
+            started.append(self.target)
+    monkeypatch.setattr(retention.threading, "Thread", Thread)
+    sweeper = retention.Sweeper()
+    sweeper.init_app(app)
+    sweeper.start()
+    assert started == [sweeper._run]
+    assert sweeper.start in app.before_request_funcs[None]
+
+    # Forked, e.g. by gunicorn with preloading enabled.
+    monkeypatch.setattr(retention.os, "getpid", lambda: -1)
+    sweeper.start()
+    sweeper.start()
+    assert started == [sweeper._run] * 2
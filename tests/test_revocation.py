@@ -0,0 +1,42 @@
+# SPDX-License-Identifier:  CC0-1.0
+"""
+Test the cache of revoked sessions.
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+from devicepasswords import revocation
+from devicepasswords.revocation import RevocationCache
+
+
+def test_lookups_cached(app, monkeypatch):
+    lookups = []
+    is_revoked = revocation._is_revoked
+
+    def _is_revoked(session, sid):
+        lookups.append(sid)
+        return is_revoked(session, sid)
+    monkeypatch.setattr(revocation, "_is_revoked", _is_revoked)
+    cache, other_worker = RevocationCache(), RevocationCache()
+    cache.init_app(app)
+    cache.ttl = 60
+    expires = datetime.now() + timedelta(hours=1)
+
+    async def lookup(*sids):
+        return [await cache.is_revoked(sid) for sid in sids]
+
+    with app.app_context():
+        assert asyncio.run(lookup("alice", "bob", "alice")) == [False] * 3
+        assert lookups == ["alice", "bob"]
+
+        # Seen after the TTL, only the sessions used again are looked up.
+        asyncio.run(other_worker.revoke("alice", expires))
+        assert asyncio.run(lookup("alice")) == [False]
+        cache._checked = None
+        assert asyncio.run(lookup("alice", "alice")) == [True, True]
+        assert lookups == ["alice", "bob", "alice"]
+
+        # Unchanged lookups are kept beyond the TTL.
+        cache._checked = None
+        assert asyncio.run(lookup("alice")) == [True]
+        assert lookups == ["alice", "bob", "alice"]
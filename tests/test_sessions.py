@@ -0,0 +1,78 @@
+# SPDX-License-Identifier:  CC0-1.0
+"""
+Test the per-worker session cache.
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from flask_session.sqlalchemy import SqlAlchemySessionInterface
+
+from devicepasswords.revocation import revocations
+from devicepasswords.sessions import CachedSqlAlchemySessionInterface
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    """Count the sessions loaded from the database."""
+    loaded = []
+    retrieve = SqlAlchemySessionInterface._retrieve_session_data
+
+    def counting(self, store_id):
+        loaded.append(store_id)
+        return retrieve(self, store_id)
+    monkeypatch.setattr(SqlAlchemySessionInterface, "_retrieve_session_data",
+                        counting)
+    return loaded
+
+
+def test_cached_endpoints(app, login, loads):
+    assert isinstance(app.session_interface,
+                      CachedSqlAlchemySessionInterface)
+    client = login()
+    for _ in range(3):
+        assert client.get("/api/ping").json == {"pong": True}
+        assert client.get("/api/tokens").status_code == 200
+    # Cached when stored by the login.
+    assert loads == []
+
+    # Other endpoints load the session.
+    client.get("/")
+    assert len(loads) == 1
+
+
+def test_cache_expires(app, login, loads):
+    app.session_interface.cache_ttl = 0.1
+    client = login()
+    client.get("/api/ping")
+    time.sleep(0.1)
+    client.get("/api/ping")
+    client.get("/api/ping")
+    assert len(loads) == 1
+
+
+def test_not_cached(app, login, loads):
+    # Logouts of sessions without sid are not revoked.
+    client = login(sid=None)
+    client.get("/api/ping")
+    client.get("/api/ping")
+    assert len(loads) == 2
+
+    # Sessions due to be refreshed may be refreshed by other workers.
+    client = login(exp=int(time.time()) + 10)
+    client.get("/api/ping")
+    assert len(loads) == 3
+
+
+def test_logout_on_other_worker(app, login):
+    client = login()
+    assert client.get("/api/ping").json == {"pong": True}
+
+    # Revoked by another worker, the cached session is not used.
+    revocations.ttl = 0
+    with app.app_context():
+        asyncio.run(revocations.revoke(
+            "alice-session", datetime.now() + timedelta(hours=1)
+        ))
+    assert client.get("/api/ping").json == {"pong": False}
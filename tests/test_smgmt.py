@@ -0,0 +1,91 @@
+# SPDX-License-Identifier:  CC0-1.0
+"""
+Test the refresh of sessions.
+"""
+import asyncio
+import time
+
+import aiohttp
+
+from devicepasswords import oidc, smgmt
+from devicepasswords.aio import background
+from devicepasswords.oidc import Redeemed
+
+
+def test_refresh_postponed(app, login, monkeypatch):
+    redeemed = []
+
+    async def redeem_refresh(refresh_token, required_claims):
+        redeemed.append(refresh_token)
+        return None, aiohttp.ClientConnectionError("IdP down")
+    monkeypatch.setattr(oidc, "redeem_refresh", redeem_refresh)
+
+    exp = int(time.time()) + 30
+    client = login(exp=exp, refresh_token="refresh")
+    assert client.get("/api/ping").json == {"pong": True}
+    assert redeemed == ["refresh"]
+    with client.session_transaction() as session:
+        assert session["exp"] == exp
+        assert session["refresh_token"] == "refresh"
+
+
+def test_refresh_failed(app, login, monkeypatch):
+    async def redeem_refresh(refresh_token, required_claims):
+        return None, ValueError("invalid_grant")
+    monkeypatch.setattr(oidc, "redeem_refresh", redeem_refresh)
+
+    client = login(exp=int(time.time()) + 30, refresh_token="refresh")
+    assert client.get("/api/ping").json == {"pong": False}
+    with client.session_transaction() as session:
+        assert "sub" not in session
+
+
+def _stored_session(app, exp):
+    data = {"sub": "alice", "sid": "alice-session", "exp": exp,
+            "refresh_token": "refresh", "email": "alice@example.com",
+            "preferred_username": "alice"}
+    with app.app_context():
+        app.session_interface.store("session-id", data)
+    return data
+
+
+def test_refresh_single_flight(app, monkeypatch):
+    redeemed = []
+    exp = int(time.time()) + 30
+
+    async def redeem_refresh(refresh_token, required_claims):
+        redeemed.append(refresh_token)
+        await asyncio.sleep(0.2)
+        return Redeemed("id-token", 3600, "rotated", None, {
+            "exp": exp + 3600, "iss": "https://idp.invalid", "sub": "alice",
+            "email": "alice@example.com", "preferred_username": "alice",
+        }, {}), None
+    monkeypatch.setattr(oidc, "redeem_refresh", redeem_refresh)
+    data = _stored_session(app, exp)
+
+    async def refresh():
+        return await asyncio.gather(
+            smgmt._join_refresh(app, oidc, "session-id", data),
+            smgmt._join_refresh(app, oidc, "session-id", data),
+            # Another worker, waiting for the lock instead.
+            smgmt._refresh(app, oidc, "session-id", data),
+        )
+    results = background.run(refresh())
+    assert redeemed == ["refresh"]
+    assert [r["refresh_token"] for r in results] == ["rotated"] * 3
+    with app.app_context():
+        assert app.session_interface.load("session-id")["exp"] == exp + 3600
+
+
+def test_refresh_lock_timeout(app, monkeypatch):
+    async def redeem_refresh(refresh_token, required_claims):
+        raise AssertionError("Refreshed without the lock")
+    monkeypatch.setattr(oidc, "redeem_refresh", redeem_refresh)
+    monkeypatch.setattr(smgmt, "REFRESH_LOCK_TIMEOUT", 0.2)
+    data = _stored_session(app, int(time.time()) + 30)
+
+    with app.app_context(), smgmt._refresh_lock("session-id"):
+        refreshed = background.run(
+            smgmt._refresh(app, oidc, "session-id", data)
+        )
+    assert refreshed is smgmt.POSTPONED
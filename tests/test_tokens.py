@@ -0,0 +1,101 @@
+# SPDX-License-Identifier:  CC0-1.0
+"""
+Test the creation of device passwords.
+"""
+import asyncio
+import importlib
+
+import flask
+import pytest
+
+from devicepasswords.db import db, Token, TokenHash
+
+# The package exports the blueprint as views.
+views = importlib.import_module("devicepasswords.views")
+
+
+def test_invalid_hash_settings(create_app, monkeypatch):
+    monkeypatch.setenv("DP_PASSWORD_HASH_SETTINGS", '["bcrypt__rounds"]')
+    with pytest.raises(ValueError):
+        create_app()
+
+
+def test_duplicate_schemes(create_app, monkeypatch):
+    monkeypatch.setenv("DP_PASSWORD_HASHES", '["plaintext", "nthash", '
+                                             '"nthash"]')
+    app = create_app()
+    assert app.config["PASSWORD_HASHES"] == ["nthash"]
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session.update({"sub": "alice", "sid": "alice-session",
+                        "state": "state", "exp": 2 ** 31,
+                        "email": "alice@example.com",
+                        "preferred_username": "alice"})
+    response = client.post("/api/tokens", data={"name": "phone",
+                                                "state": "state"})
+    assert response.json["status"] == "ok"
+    with app.app_context():
+        assert db.session.execute(
+            db.select(TokenHash.scheme)
+        ).scalars().all() == ["nthash"]
+
+
+def test_login_taken_concurrently(app, login, monkeypatch):
+    client = login()
+    assert client.post("/api/tokens", data={
+        "name": "phone", "state": "state"
+    }).json["status"] == "ok"
+    with app.app_context():
+        taken = db.session.execute(db.select(Token.login)).scalar_one()
+
+    # The first login was allocated by another request meanwhile.
+    allocated = [taken]
+    allocate_login = views.allocate_login
+
+    async def allocate(username):
+        return allocated.pop() if allocated else \
+            await allocate_login(username)
+    monkeypatch.setattr(views, "allocate_login", allocate)
+    response = client.post("/api/tokens", data={"name": "laptop",
+                                                "state": "state"})
+    assert response.json["status"] == "ok"
+    assert response.json["login"] != taken
+
+
+def test_hashes_cancelled(app, monkeypatch):
+    hashes = []
+
+    async def hash(secret, scheme):
+        hashes.append(asyncio.current_task())
+        await asyncio.sleep(60)
+
+    async def allocate(username):
+        await asyncio.sleep(0)
+        raise RuntimeError("Database down")
+
+    async def valid_session(oidc):
+        return True
+    monkeypatch.setattr(views.hash_pool, "hash", hash)
+    monkeypatch.setattr(views, "allocate_login", allocate)
+    monkeypatch.setattr(views, "valid_session", valid_session)
+
+    async def create():
+        with pytest.raises(RuntimeError):
+            await views.tokens()
+        # Checked before the remaining tasks are cancelled by the loop.
+        return [task.cancelling() for task in hashes]
+    with app.test_request_context("/api/tokens", method="POST", data={
+        "name": "phone", "state": "state"
+    }):
+        flask.session.update({"sub": "alice", "state": "state",
+                              "preferred_username": "alice"})
+        assert asyncio.run(create()) == [1]
+
+
+def test_other_integrity_errors(app, login):
+    # Not a login collision, e.g. an invalid configuration.
+    app.config["PASSWORD_HASHES"] = ["nthash", "nthash"]
+    response = login().post("/api/tokens", data={"name": "phone",
+                                                 "state": "state"})
+    assert response.status_code == 500
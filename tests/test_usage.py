@@ -0,0 +1,41 @@
+# SPDX-License-Identifier:  CC0-1.0
+"""
+Test the recording of token uses.
+"""
+import importlib
+import uuid
+
+# The package exports the recorder as usage.
+usage_module = importlib.import_module("devicepasswords.usage")
+
+
+def test_flush_thread_per_process(app, monkeypatch):
+    started = []
+
+    class Thread:
+        def __init__(self, target, **kwargs):
+            self.target = target
+
+        def start(self):
+            started.append(self.target)
+    monkeypatch.setattr(usage_module.threading, "Thread", Thread)
+    monkeypatch.setattr(usage_module.atexit, "register", lambda fn: None)
+    recorder = usage_module.UsageRecorder()
+    recorder.init_app(app)
+    assert started == []
+
+    token_id = uuid.uuid4()
+    recorder.record(token_id)
+    recorder.record(token_id)
+    assert started == [recorder._run]
+
+    # Forked, e.g. by gunicorn with preloading enabled. The uses recorded
+    # before are flushed by the parent.
+    monkeypatch.setattr(usage_module.os, "getpid", lambda: -1)
+    recorder.record(token_id)
+    assert started == [recorder._run] * 2
+    assert recorder._pending[token_id][0] == 1
+
+    with app.app_context():
+        recorder._flush_app()
+    assert recorder._pending == {}
@@ -0,0 +1,89 @@
+# SPDX-License-Identifier:  CC0-1.0
+"""
+Test the password verification API.
+"""
+import pytest
+
+from devicepasswords.db import db, Token, User
+from devicepasswords.pwdhash import hasher
+
+AUTHORIZATION = {"Authorization": "Bearer key"}
+
+
+@pytest.fixture
+def client(app):
+    app.config["VERIFY_API_KEY"] = "key"
+    with app.app_context():
+        db.session.add(User(sub="alice", username="alice",
+                            email="alice@example.com"))
+        # Hashed before DP_PASSWORD_HASH was changed to plaintext.
+        db.session.add(Token(sub="alice", name="phone", login="alice#1",
+                             token=hasher.hash("secret-1", scheme="bcrypt")))
+        db.session.add(Token(sub="alice", name="laptop", login="alice#2",
+                             token="secret-2"))
+        db.session.commit()
+    return app.test_client()
+
+
+def test_verify(client):
+    response = client.post("/api/verify", headers=AUTHORIZATION,
+                           json={"login": "alice#1", "password": "secret-1"})
+    assert response.status_code == 200
+    assert response.json["sub"] == "alice"
+
+    response = client.post("/api/verify", headers=AUTHORIZATION,
+                           data={"login": "alice#2", "password": "secret-2"})
+    assert response.status_code == 200
+
+
+def test_verify_invalid(client):
+    for login, password in [("alice#1", "secret-2"), ("alice#2", "secret-1"),
+                            ("bob#1", "secret-1")]:
+        response = client.post("/api/verify", headers=AUTHORIZATION,
+                               json={"login": login, "password": password})
+        assert response.status_code == 401
+
+    response = client.post("/api/verify", json={"login": "alice#1",
+                                                "password": "secret-1"})
+    assert response.status_code == 401
+
+
+def test_verify_malformed(client):
+    for body in ([1], "alice#1", {"login": "alice#1"},
+                 {"login": 1, "password": "secret-1"}):
+        response = client.post("/api/verify", headers=AUTHORIZATION,
+                               json=body)
+        assert response.status_code == 400
+
+
+def test_verify_disabled(app):
+    response = app.test_client().post("/api/verify", headers=AUTHORIZATION,
+                                      json={"login": "alice#1",
+                                            "password": "secret-1"})
+    assert response.status_code == 404
+
+
+def test_verify_created(create_app, monkeypatch):
+    monkeypatch.setenv("DP_PASSWORD_HASHES", '["nthash"]')
+    monkeypatch.setenv("DP_VERIFY_API_KEY", "key")
+    app = create_app()
+    with app.app_context():
+        # Added by the login.
+        db.session.add(User(sub="alice", username="alice",
+                            email="alice@example.com"))
+        db.session.commit()
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session.update({"sub": "alice", "sid": "alice-session",
+                        "state": "state", "exp": 2 ** 31,
+                        "email": "alice@example.com",
+                        "preferred_username": "alice"})
+    created = client.post("/api/tokens", data={"name": "phone",
+                                               "state": "state"}).json
+    assert created["status"] == "ok"
+
+    response = client.post("/api/verify", headers=AUTHORIZATION, json={
+        "login": created["login"], "password": created["secret"]
+    })
+    assert response.status_code == 200
+    assert response.json["sub"] == "alice"